@@ -4,8 +4,13 @@ import matplotlib.pyplot as plt
 from datetime import datetime
 import time
 import pandas as pd
-from scipy.ndimage import minimum_filter1d  # Added import
 import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from baseline import remove_baseline  # noqa: E402
+from darkframes import dark_frames  # noqa: E402
 
 print("\n\033[1m[RAMAN SPECTROMETER TERMINAL]\033[0m")
 
@@ -18,6 +23,9 @@ image_files = [
     f for f in os.listdir(folder_path) if f.lower().endswith((".jpg", ".jpeg"))
 ]
 
+# Load dark frame once; the store keeps a binary copy between runs
+dark_intensities = dark_frames.get("dark_frame.csv", "webcam")
+
 plt.ion()
 fig, ax = plt.subplots(figsize=(8, 6))
 
@@ -43,10 +51,6 @@ for image_file in image_files:
     roll = np.zeros((length, rolling))
     roll_i = 0
 
-    # Load dark frame
-    dark_frame = pd.read_csv("dark_frame.csv")
-    dark_intensities = dark_frame["Intensity"].values
-
     (line,) = ax.plot([], [], label=image_file)
     (nocorrect,) = ax.plot([], [], alpha=0.5)
 
@@ -74,10 +78,9 @@ for image_file in image_files:
         print(f"Spectrum saved to {filename}")
         return filename
 
-    def removeFluor(intensities, window_size=10):
-        baseline = minimum_filter1d(intensities, window_size, mode="reflect")
-        corrected = intensities - baseline
-        return np.clip(corrected, 0, None)  # Ensure non-negative values
+    def removeFluor(intensities):
+        # ALS baseline follows broad fluorescence without eating into the peaks
+        return np.clip(remove_baseline(intensities), 0, None)
 
     # Add lines to image
     frame = cv2.line(frame, (0, y1), (frame.shape[1], y1), (0, 255, 0), 1)
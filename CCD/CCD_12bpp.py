@@ -1,15 +1,24 @@
-import time
+import sys
+from pathlib import Path
+
 import matplotlib.pyplot as plt
 import numpy as np
 import serial
-from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from averaging import RunningStats, average_until  # noqa: E402
+from tcd1304 import read_ch341_frame  # noqa: E402
 
 # Constants
 length = 3648  # Number of pixels
 bytes_expected = length * 2  # 2 bytes per pixel (12-bit data in 16-bit container)
-averages = 1
+averages = 1  # frames per spectrum when neither target_snr nor time_budget is set
+max_frames = 64  # cap on the frames averaged for target_snr or time_budget
+target_snr = None  # stop averaging early once the whole-frame SNR is reached
+time_budget = None  # seconds per averaged spectrum
 baudrate: int = 921600
 timeout: float = 1
+rx_buffer = bytearray(bytes_expected)  # reused for every frame
 
 '''
 # Raman
@@ -24,33 +33,23 @@ raman_wavenumbers = (10000000 / wavelengths) - laser_wavenumber
 
 def read_sensor_data_12bpp(ser):
     """
-    Reads 12-bit data (packed in 16-bit words) from the TCD1304 sensor.
+    Reads 12-bit data (packed in 16-bit words) from the TCD1304 sensor;
+    None if the frame was incomplete.
     """
-    ser.reset_input_buffer()
-
     packet = bytearray()
     packet.append(0xA1)  # read TCD1304 module (12 bpp, 7296 bytes)
     # packet.append(0xA2)  # read TCD1304 module (8 bpp, 3648 bytes)
     packet.append(0xD7)  # set integration time (Max D7, min B0)
-    ser.write(packet)  # Request data
-
-    buffer = bytearray()
-    start_time = time.time()
-    timeout_duration = 5
 
-    while len(buffer) < bytes_expected:
-        if time.time() - start_time > timeout_duration:
-            print(f"Timeout reached. Received {len(buffer)} bytes out of {bytes_expected}.")
-            break
-        if ser.in_waiting > 0:
-            buffer += ser.read(ser.in_waiting)
+    status = read_ch341_frame(ser, packet, rx_buffer, timeout=5)
 
-    if len(buffer) < bytes_expected:
-        print("Warning: Incomplete data received.")
-        return np.zeros(length, dtype=np.uint16)
+    if not status.complete:
+        print(f"Timeout reached. {status}.")
+        print("Warning: Incomplete data received, frame skipped.")
+        return None
 
     # Interpret as 16-bit words, assuming little-endian format
-    raw_data = np.frombuffer(buffer[:bytes_expected], dtype=np.uint16)
+    raw_data = np.frombuffer(rx_buffer, dtype=np.uint16)
 
     # Mask to 12-bit data
     pixel_data = raw_data & 0x0FFF
@@ -84,12 +83,22 @@ if __name__ == "__main__":
     ser = serial.Serial(port_name, baudrate, timeout=timeout)
     print(f"Connected to {port_name}")
 
+    stats = RunningStats(length)
+    # averages only applies to fixed averaging; an SNR or time target
+    # averages up to max_frames
+    adaptive = target_snr is not None or time_budget is not None
     while True:
         try:
-            data = np.zeros(length, dtype=np.float64)
-            for i in tqdm(range(averages)):
-                data += read_sensor_data_12bpp(ser)
-            data /= averages
+            data, stderr, n = average_until(
+                lambda: read_sensor_data_12bpp(ser),
+                length,
+                max_frames=max_frames if adaptive else averages,
+                target_snr=target_snr,
+                time_budget=time_budget,
+                reference=4095,
+                stats=stats,
+            )
+            print(f"Averaged {n} frames, SNR {stats.snr(reference=4095):.0f}")
             convert_and_plot_12bpp(data)
         except serial.SerialException as e:
             print(f"Serial port error: {e}")
@@ -1,15 +1,20 @@
-import time
+import sys
+from pathlib import Path
 
 import matplotlib.pyplot as plt
 import numpy as np
 import serial
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from tcd1304 import read_ch341_frame  # noqa: E402
+
 # Variables
 length = 3648
 averages = 1
 baudrate: int = 921600
 timeout: float = 1
+rx_buffer = bytearray(length)  # reused for every frame
 
 
 def read_sensor_data(ser):
@@ -20,36 +25,19 @@ def read_sensor_data(ser):
     :param timeout: Serial timeout in seconds.
     :return: Numpy array of raw sensor data (3648 pixels in 8-bit mode)
     """
-    # Initialize array for 3648 pixels (8-bit mode)
-    sensor_raw_data = np.zeros(length, dtype=np.uint8)
-
     # Send initialization command (0xA2 for 8-bit mode)
     packet = bytearray()
     # packet.append(0xA1)  # read TCD1304 module (12 bpp, 7296 bytes)
     packet.append(0xA2)  # read TCD1304 module (8 bpp, 3648 bytes)
 
-    ser.write(packet)
-
-    i = 0
-    start_time = time.time()
-    timeout_duration = 5  # Maximum time to wait for data in seconds
-
-    while i < length:
-        # Check for timeout
-        if time.time() - start_time > timeout_duration:
-            print(f"Timeout reached. Received {i} bytes out of 3648.")
-            break
-
-        # Read available bytes
-        bytes_available = ser.in_waiting
-        if bytes_available > 0:
-            # Read up to the remaining bytes we need
-            bytes_to_read = min(bytes_available, length - i)
-            data = ser.read(bytes_to_read)
+    # Maximum time to wait for data in seconds
+    status = read_ch341_frame(ser, packet, rx_buffer, timeout=5)
+    if not status.complete:
+        print(f"Timeout reached. {status}.")
+        rx_buffer[status.received :] = bytes(length - status.received)
 
-            # Store the bytes in our array
-            sensor_raw_data[i : i + len(data)] = np.frombuffer(data, dtype=np.uint8)
-            i += len(data)
+    # 8-bit pixels are the raw bytes; copied, as the next read reuses the buffer
+    sensor_raw_data = np.frombuffer(rx_buffer, dtype=np.uint8).copy()
 
     return sensor_raw_data
 
@@ -1,46 +1,41 @@
+import sys
 import time
+from pathlib import Path
+
 import matplotlib.pyplot as plt
 import numpy as np
 import serial
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from tcd1304 import read_ch341_frame  # noqa: E402
+
 # Constants
 length = 3648  # Number of pixels
 bytes_expected = length * 2  # 2 bytes per pixel (12-bit data in 16-bit container)
 averages = 1
 baudrate = 921600
 timeout = 1
+rx_buffer = bytearray(bytes_expected)  # reused for every frame
 
 def read_sensor_data_12bpp(ser, integration_cmd):
     """
     Reads 12-bit data (packed in 16-bit words) from the TCD1304 sensor using a given integration time command byte.
     """
-    ser.reset_input_buffer()
-
     packet = bytearray()
     packet.append(0xA1)  # read TCD1304 module (12 bpp)
     packet.append(integration_cmd)  # integration time setting
     # Max D6
     # Min B0
 
-    ser.write(packet)
-
-    buffer = bytearray()
-    start_time = time.time()
-    timeout_duration = 5
-
-    while len(buffer) < bytes_expected:
-        if time.time() - start_time > timeout_duration:
-            print(f"Timeout reached. Received {len(buffer)} bytes out of {bytes_expected}.")
-            break
-        if ser.in_waiting > 0:
-            buffer += ser.read(ser.in_waiting)
+    status = read_ch341_frame(ser, packet, rx_buffer, timeout=5)
 
-    if len(buffer) < bytes_expected:
+    if not status.complete:
+        print(f"Timeout reached. {status}.")
         print("Warning: Incomplete data received.")
         return np.zeros(length, dtype=np.uint16)
 
-    raw_data = np.frombuffer(buffer[:bytes_expected], dtype=np.uint16)
+    raw_data = np.frombuffer(rx_buffer, dtype=np.uint16)
     pixel_data = raw_data & 0x0FFF  # Mask to 12-bit data
 
     return pixel_data
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import numpy as np
+
+from tcd1304 import length
+
+
+class FrameRing:
+    """
+    Fixed-size preallocated ring of frames for one producer and one consumer.
+    The producer never waits: when the consumer falls behind, the oldest frames
+    are overwritten and counted in `dropped`. No lock is taken; a frame is
+    published by bumping `written` after its slot is filled, and readers check
+    afterwards that the slot was not reused while they copied it.
+    """
+
+    def __init__(self, capacity=16, length=length, dtype=np.uint16):
+        if capacity < 2:
+            raise ValueError("FrameRing needs a capacity of at least 2")
+        self.capacity = capacity
+        self.frames = np.zeros((capacity, length), dtype)
+        self.timestamps = np.zeros(capacity)
+        self.written = 0  # frames pushed so far
+        self.consumed = 0  # index of the next frame the consumer has not seen
+        self.dropped = 0  # frames overwritten or skipped before being read
+
+    def push(self, frame, timestamp=None):
+        slot = self.written % self.capacity
+        self.frames[slot] = frame
+        self.timestamps[slot] = time.perf_counter() if timestamp is None else timestamp
+        self.written += 1
+
+    def _valid(self, index):
+        # the producer is filling slot `written % capacity` (frame written - capacity)
+        return index + self.capacity > self.written
+
+    def latest(self, out=None):
+        """
+        Copies the newest frame into `out` (or a new array) and marks everything
+        before it as consumed. Returns (frame, timestamp), or (None, None) if no
+        new frame has arrived.
+        """
+        while True:
+            index = self.written - 1
+            if index < self.consumed:
+                return None, None
+            slot = index % self.capacity
+            if out is None:
+                out = np.empty_like(self.frames[slot])
+            out[:] = self.frames[slot]
+            timestamp = self.timestamps[slot]
+            if self._valid(index):
+                break
+        self.dropped += index - self.consumed
+        self.consumed = index + 1
+        return out, timestamp
+
+    def drain(self):
+        """
+        Copies every unread frame out in acquisition order.
+        Returns (frames, timestamps) with shape (n, length) and (n,).
+        """
+        written = self.written
+        start = max(self.consumed, written - self.capacity + 1)
+        indices = np.arange(start, written)
+        slots = indices % self.capacity
+        frames = self.frames[slots]
+        timestamps = self.timestamps[slots]
+
+        valid = indices + self.capacity > self.written
+        self.dropped += start - self.consumed + np.count_nonzero(~valid)
+        self.consumed = written
+        return frames[valid], timestamps[valid]
+
+
+class AcquisitionThread(threading.Thread):
+    """
+    Keeps requesting frames with `read_frame()` and pushes them into `ring`, so
+    the sensor is never left idle while the consumer decodes, fits or plots.
+    """
+
+    def __init__(self, read_frame, ring):
+        super().__init__(daemon=True)
+        self.read_frame = read_frame
+        self.ring = ring
+        self.frames = 0
+        self.errors = 0
+        self.last_error = None
+        self.started_at = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        self.started_at = time.perf_counter()
+        while not self._stop_event.is_set():
+            try:
+                frame = self.read_frame()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+                self._stop_event.wait(0.1)
+                continue
+            self.ring.push(frame)
+            self.frames += 1
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self.join(timeout)
+
+    @property
+    def fps(self):
+        if not self.started_at:
+            return 0.0
+        return self.frames / (time.perf_counter() - self.started_at)
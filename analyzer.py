@@ -1,12 +1,17 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from datetime import datetime
 import time
+import os
 
-# from Main import main as similarity
 import pandas as pd
-from scipy.ndimage import minimum_filter1d  # Added import
+
+from averaging import BOXCAR, EMA, TemporalAverage
+from baseline import remove_baseline
+from calibration import load_calibration
+from liveplot import LivePlot
+from similarity import SpectralLibrary, print_matches
+from spectrum_store import open_store
+from webcam import WebcamCapture, open_camera, roi_rows
 
 print("\n\033[1m[RAMAN SPECTROMETER TERMINAL]\033[0m")
 
@@ -15,12 +20,9 @@ t0 = time.perf_counter()
 
 length = 1920
 height = 1080
-cap = cv2.VideoCapture(0, cv2.CAP_V4L2)
-
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, length)
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+pixel_format = "YUYV"  # spectrum from luma; None for BGR frames (channel mean)
+cap = open_camera(0, length, height, fourcc=pixel_format)
 
-# cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('Y', 'U', 'Y', '2'))
 # cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 3)
 # cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)
 # cap.set(cv2.CAP_PROP_EXPOSURE, -4.0)
@@ -28,48 +30,81 @@ cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
 print("Loaded Camera:", int(1e3 * (time.perf_counter() - t0)), "ms\n")
 
 # Calibration
-calibrate = [0.5378783977636364, 251.83884117409121]
-wavelengths = (1920 / length) * np.arange(length) * calibrate[0] + calibrate[1]
-laser_wavenumber = 10000000 / 532
+calibration = load_calibration("webcam").for_pixels(length)
+calibrate = calibration.coefficients.tolist()
+wavelengths = calibration.wavelengths
+laser_wavenumber = calibration.laser_wavenumber
 max_wave = 4000
-wavenumbers = (10000000 / wavelengths) - laser_wavenumber
-
-y1, y2 = int(0.53 * height), int(0.64 * height)
-rolling = 1
-roll = np.zeros((length, rolling))
-roll_i = 0
+wavenumbers = -calibration.raman_wavenumbers
+
+y1, y2 = roi_rows(height)
+rolling = 1  # frames averaged; +/- in the image window double/halve it
+averaging_mode = BOXCAR  # or EMA; m in the image window switches
+store_file = "spectra.spec"  # saved spectra are appended here
+library_file = "library.npz"  # built with: python similarity.py --build
+library = SpectralLibrary.load(library_file) if os.path.exists(library_file) else None
+average = TemporalAverage(length, rolling, averaging_mode)
+
+# Dark frame, recorded with d in the image window. It is only valid for the
+# reducer that made it: YUYV luma and the BGR channel mean differ in scale
+dark_frame_file = "dark_frame.csv"
+reducer = pixel_format or "BGR"
+
+
+def load_dark_frame(path=dark_frame_file):
+    if not os.path.exists(path):
+        print(f"No {path}; press d with the laser off to record one")
+        return np.zeros(length)
+    dark_frame = pd.read_csv(path)
+    # Files from before the Reducer column were BGR channel means
+    made_by = dark_frame["Reducer"].iloc[0] if "Reducer" in dark_frame else "BGR"
+    if made_by != reducer:
+        print(
+            f"Ignoring {path}: recorded from {made_by} frames, capturing {reducer}; "
+            "press d with the laser off to record it again"
+        )
+        return np.zeros(length)
+    return dark_frame["Intensity"].values
+
+
+def save_dark_frame(intensities, path=dark_frame_file):
+    pd.DataFrame({"Intensity": intensities, "Reducer": reducer}).to_csv(
+        path, index=False
+    )
+    print(f"Dark frame ({reducer}) saved to {path}")
 
-# Load dark frame
-dark_frame = pd.read_csv("dark_frame.csv")
-dark_intensities = dark_frame["Intensity"].values
 
-plt.ion()
-fig, ax = plt.subplots(figsize=(8, 6))
-(line,) = ax.plot([], [], "k")
-(nocorrect,) = ax.plot([], [], "k", alpha=0.5)
+dark_intensities = load_dark_frame()
 
-ax.set_title("Spectrometer Output")
-ax.set_ylim(0, 255)
-ax.set_xlim(np.min(wavelengths), np.max(wavelengths))
-# ax.set_xlim(np.min(wavenumbers),np.max(wavenumbers))
-# ax.set_xlabel('Wavenumber (1/cm)')
-ax.set_ylabel("Intensity (arb.)")
-plt.tight_layout()
+# Blitted live view, redrawn at most 30 times a second; wavenumbers as the
+# axis with xlabel "Wavenumber (1/cm)" for Raman shifts
+plot = LivePlot(
+    wavelengths,
+    styles=("k",),
+    title="Spectrometer Output",
+    ylabel="Intensity (arb.)",
+    ylim=(0, 255),
+    autoscale=False,
+    figsize=(8, 6),
+)
+plot.fig.tight_layout()
 
 
 def save_spectrum(wavelengths, intensities):
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"spectrum_{timestamp}.csv"
-
-    # Create DataFrame with wavelength and intensity data
-    df = pd.DataFrame(
-        {"Wavelength": wavelengths, "Wavenumber": wavenumbers, "Intensity": intensities}
-    )
-
-    # Save to CSV
-    df.to_csv(filename, index=False)
-    print(f"Spectrum saved to {filename}")
-    return filename
+    # Append to the spectrum store with what is needed to rebuild the axis
+    metadata = {
+        "sensor": "webcam",
+        "laser_nm": 1e7 / laser_wavenumber,
+        "calibration": calibrate,
+        "rows": [y1, y2],
+        "pixel_format": pixel_format,
+        "rolling": average.window,
+        "averaging": average.mode,
+        "dark_frame": dark_frame_file if dark_intensities.any() else None,
+    }
+    index = open_store(store_file).append(intensities, metadata)
+    print(f"Spectrum saved to {store_file}[{index}]")
+    return index
 
 
 """
@@ -83,46 +118,70 @@ def removeFluor(frame):
 """
 
 
-def removeFluor(intensities, window_size=10):
-    baseline = minimum_filter1d(intensities, window_size, mode="reflect")
-    corrected = intensities - baseline
-    return np.clip(corrected, 0, None)  # Ensure non-negative values
-
+def removeFluor(intensities):
+    # ALS baseline follows broad fluorescence without eating into the peaks
+    return np.clip(remove_baseline(intensities), 0, None)
 
-while True:
-    _, frame = cap.read()
-    frame = cv2.line(frame, (0, y1), (frame.shape[1], y1), (0, 255, 0), 1)
-    frame = cv2.line(frame, (0, y2), (frame.shape[1], y2), (0, 255, 0), 1)
-    frame = cv2.flip(frame, 1)
-    cv2.imshow("Image", frame)
 
-    frame = np.array(frame)
-    spectrum = np.mean(frame[y1:y2], axis=(0, 2))
-    roll[:, roll_i % rolling] = spectrum
+# Frames are read and reduced to spectra on a background thread at the
+# camera's rate; this loop only plots
+capture = WebcamCapture(cap, (y1, y2), length).start()
+last_report = time.perf_counter()
 
-    data = np.average(roll, axis=1)
+while True:
+    preview = capture.preview()
+    if preview is not None:
+        cv2.imshow("Image", preview)
+
+    spectra, _ = capture.ring.drain()
+    if not len(spectra):
+        key = cv2.waitKey(10) & 0xFF
+        if key == ord("q"):
+            break
+        continue
+    for spectrum in spectra:
+        averaged = average.update(spectrum)
 
     # Subtract dark frame
-    data = data - dark_intensities
+    data = averaged - dark_intensities
 
     data_noremove = data - np.min(data)
-    data = removeFluor(data)
-
-    # line.set_data(wavelengths, data)
-    nocorrect.set_data(wavelengths, data_noremove)
 
-    plt.pause(0.1)
+    # plot.update(removeFluor(data)) for the spectrum without fluorescence
+    plot.update(data_noremove)
 
-    roll_i += 1
+    if time.perf_counter() - last_report > 5:
+        last_report = time.perf_counter()
+        print(
+            f"Camera: {capture.fps:.1f} fps, {capture.ring.written} frames, "
+            f"plot {plot.fps:.1f} fps"
+        )
+        if capture.thread.last_error:
+            print(f"Camera error: {capture.thread.last_error}")
+            capture.thread.last_error = None
 
     key = cv2.waitKey(10) & 0xFF
     if key == ord("q"):
         break
+    elif key in (ord("+"), ord("=")):
+        average.window = min(2 * average.window, average.max_window)
+        print(f"Averaging {average.window} frames ({average.mode})")
+    elif key == ord("-"):
+        average.window = max(average.window // 2, 1)
+        print(f"Averaging {average.window} frames ({average.mode})")
+    elif key == ord("m"):
+        average.mode = EMA if average.mode == BOXCAR else BOXCAR
+        print(f"Averaging {average.window} frames ({average.mode})")
+    elif key == ord("d"):
+        dark_intensities = averaged.copy()
+        save_dark_frame(dark_intensities)
     elif key == ord("s"):
-        filename = save_spectrum(wavelengths, data_noremove)
-        # similarity(filename)
+        save_spectrum(wavelengths, data_noremove)
+        if library is not None:
+            print_matches(library.match(data_noremove, calibration.raman_wavenumbers))
 
 
+capture.stop()
 cap.release()
 cv2.destroyAllWindows()
-plt.close("all")
+plot.close()
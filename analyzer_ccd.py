@@ -1,10 +1,12 @@
 import time
 
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import serial
-from scipy.ndimage import gaussian_filter
+from acquisition import AcquisitionThread, FrameRing
+from calibration import load_calibration
+from core import TimingError, check_timing, er_periods, process_er_frame, smooth
+from darkframes import dark_frames
+from liveplot import LivePlot
+from spectrum_store import open_store
+from tcd1304 import SensorSession, er_packet, read_er_frame
 
 # Constants
 length = 3694  # Number of pixels (updated per documentation - 7388 bytes / 2)
@@ -19,163 +21,117 @@ balanced = False
 averages = 1
 gaussian_mag = 6
 baudrate: int = 115200
-dark_frame_file = None #"240_dark_large.csv" # "120_dark_large.csv" # "240_dark_large.csv"  # "240_dark.csv"
+dark_frame_file = None #"240_dark_large.csv" # "120_dark_large.csv" # "240_dark_large.csv"  # "240_dark.csv"  # "dark_model.npz" (dark_model.py)
 save = False
+store_file = "spectra.spec"  # saved spectra are appended here
 save_dark_Frame = False
 
-txfull = np.uint8([0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-SHperiod = np.uint32(SH * 2)
-ICGperiod = np.uint32(ICG * 2)
-
-if ICGperiod % SHperiod:
-    print("TIMING VIOLATION: NOT DIVISIBLE")
-    exit()
-elif SHperiod < 20:
-    print("TIMING VIOLATION: SH PERIOD TOO SMALL")
-    exit()
-elif ICGperiod < 14776:
-    print("TIMING VIOLATION: ICG PERIOD TOO SMALL")
-    exit()
-
-AVGn = np.uint8([0, averages])
-
+SHperiod, ICGperiod = er_periods(SH, ICG)
 
 # Raman
-laser_wavenumber = 10000000 / 632.80
+calibration_session = None  # None for the current optics, "legacy" for the old ones
+calibration = load_calibration("er", calibration_session)
+laser_wavenumber = calibration.laser_wavenumber
 max_wave = 4000
-"""
-points = np.array(
-    [
-        [19, 587.6],
-        [127, 593.4],
-        [262, 599.7],
-        [501, 611.6],
-        [920, 631.6],
-        [962.5, 632.80],
-        [1358, 650.8],
-        [1638, 662.6],
-        [2276, 687.7],
-        [2439, 693.7],
-    ]
-)  # Wavelength pixel pairs
-"""
-points = np.array(
-    [
-        [388.6, 667.43],
-        [524, 673.27],
-        [714, 682.46],
-        [1084, 696.83],
-        [3164, 773.83],
-        [3226, 776.23],
-        [3323, 779.86],
-    ]
-)
-
-# new optical system slope
-# slope = np.array([[292.2, 542.2], [379.2, 546.5], [1550, 599.7], [1820, 611.6]])
-calibrate = np.polyfit(points[:, 0], points[:, 1], 1)  # obtain calibrate linear fit
-wavelengths = np.arange(length) * calibrate[0] + calibrate[1]
-raman_wavenumbers = laser_wavenumber - (10000000 / wavelengths)
+calibrate = calibration.coefficients
+wavelengths = calibration.wavelengths
+raman_wavenumbers = calibration.raman_wavenumbers
 
 
 def read_sensor_data_12bpp(ser):
     """
     Reads 12-bit data (packed in 16-bit words) from the TCD1304 sensor.
     """
-    ser.reset_input_buffer()
-
-    # Create packet with ER key and timing parameters
-    txfull[0] = 69
-    txfull[1] = 82
-    # split 32-bit integers to be sent into 8-bit data
-    txfull[2] = (SHperiod >> 24) & 0xFF
-    txfull[3] = (SHperiod >> 16) & 0xFF
-    txfull[4] = (SHperiod >> 8) & 0xFF
-    txfull[5] = SHperiod & 0xFF
-    txfull[6] = (ICGperiod >> 24) & 0xFF
-    txfull[7] = (ICGperiod >> 16) & 0xFF
-    txfull[8] = (ICGperiod >> 8) & 0xFF
-    txfull[9] = ICGperiod & 0xFF
-    txfull[10] = AVGn[0]
-    txfull[11] = AVGn[1]
-
-    ser.write(txfull)  # Send command packet
-
-    buffer = ser.read(7388)
-    rxData16 = np.zeros(3694, np.uint16)
-    for rxi in range(3694):
-        rxData16[rxi] = (buffer[2 * rxi + 1] << 8) + buffer[2 * rxi]
-
-    return rxData16
-
-
-def convert_and_plot_12bpp(sensor_data, save_csv=False, dark_frame_file=None):
-    pixels = np.arange(len(sensor_data))
-    sensor_data = (sensor_data[10] + sensor_data[11]) / 2 - sensor_data
-    sensor_data = np.flip(sensor_data)
-    if balanced:
-        offset = (
-            sensor_data[18]
-            + sensor_data[20]
-            + sensor_data[22]
-            + sensor_data[24]
-            - sensor_data[19]
-            - sensor_data[21]
-            - sensor_data[23]
-            - sensor_data[24]
-        ) / 4
-        for i in range(1847):
-            sensor_data[2 * i] = sensor_data[2 * i] - offset
+    return read_er_frame(ser, er_packet(SHperiod, ICGperiod, averages))
+
+
+def convert_and_plot_12bpp(
+    sensor_data, save_spectrum=False, dark_frame_file=None, plot=None
+):
+    sensor_data = process_er_frame(sensor_data, balanced)
 
     # Subtract dark frame if provided
     if dark_frame_file and not save_dark_Frame:
         try:
-            dark_frame = pd.read_csv(dark_frame_file)["intensity"].values
-            sensor_data = sensor_data - dark_frame
+            dark_frames.subtract(sensor_data, dark_frame_file, "er", SH, ICG, averages)
         except Exception as e:
             print(f"Error loading dark frame: {e}")
 
-    # Save to CSV if requested
-    if save_csv:
-        df = pd.DataFrame({"intensity": sensor_data})
-        df.to_csv(f"spectrum_{time.strftime('%Y%m%d_%H%M%S')}.csv", index=False)
-        print("Saved", f"spectrum_{time.strftime('%Y%m%d_%H%M%S')}.csv")
+    # Append to the spectrum store if requested
+    if save_spectrum:
+        metadata = {
+            "sensor": "er",
+            "SH": SH,
+            "ICG": ICG,
+            "averages": averages,
+            "balanced": balanced,
+            "laser_nm": 1e7 / laser_wavenumber,
+            "calibration": calibrate,
+            "calibration_session": calibration_session,
+            "dark_frame": None if save_dark_Frame else dark_frame_file,
+        }
+        index = open_store(store_file).append(sensor_data, metadata)
+        print("Saved", f"{store_file}[{index}]")
     if save_dark_Frame:
+        import pandas as pd
+
         print("Saved dark_frame.csv")
         df = pd.DataFrame({"intensity": sensor_data})
         df.to_csv("dark_frame.csv", index=False)
 
-    plt.figure(figsize=(10, 6))
-    if gaussian_mag != 0:
-        sensor_data = gaussian_filter(sensor_data, gaussian_mag)
-    plt.plot(raman_wavenumbers, sensor_data)
-    plt.xlabel("Wavenumber ($cm^{-1}$)")
-    # plt.xlabel("Wavelength")
-    # plt.xlabel("Pixel")
-    plt.ylabel("Intensity (12-bit)")
-    plt.ylim(-500, 2500)
-    plt.grid(True)
-
-    plt.show()
+    sensor_data = smooth(sensor_data, gaussian_mag)
+    if plot is not None:
+        plot.update(sensor_data, force=True)
+    return sensor_data
 
 
 if __name__ == "__main__":
+    import serial
+
+    try:
+        check_timing(SHperiod, ICGperiod)
+    except TimingError as e:
+        print(e)
+        exit()
+
     port_name = "/dev/ttyACM0"
-    while True:
-        try:
-            ser = serial.Serial(port_name, baudrate)
-            print(f"\n\nConnected to {port_name}")
-
-            print("\nRead Sensor w/ T-INT TIME", averages * (ICG / 1e6))
-            print("Start time:", time.strftime("%H:%M"))
-            convert_and_plot_12bpp(
-                read_sensor_data_12bpp(ser),
-                save_csv=save,
-                dark_frame_file=dark_frame_file,
-            )
-            time.sleep(0.1)
-            ser.close()
-        except serial.SerialException as e:
-            print(f"Serial port error: {e}")
-        except Exception as e:
-            print(f"An error occurred: {e}")
+    # Keep the port open across acquisitions, reconnecting only when it drops
+    session = SensorSession(port_name, baudrate, SHperiod, ICGperiod, averages)
+    # One window for every acquisition; xlabel "Wavelength" or "Pixel" with
+    # wavelengths or pixels as the axis
+    plot = LivePlot(
+        raman_wavenumbers,
+        xlabel="Wavenumber ($cm^{-1}$)",
+        ylabel="Intensity (12-bit)",
+        ylim=(-500, 2500),
+        autoscale=False,
+    )
+
+    # Acquire on a background thread so the window stays responsive during
+    # long integrations
+    ring = FrameRing(length=length)
+    acquisition = AcquisitionThread(session.acquire, ring)
+    print("\nRead Sensor w/ T-INT TIME", averages * (ICG / 1e6))
+    acquisition.start()
+    try:
+        while True:
+            try:
+                sensor_data, _ = ring.latest()
+                if sensor_data is None:
+                    plot.pause(0.05)
+                    continue
+                print("Received:", time.strftime("%H:%M:%S"))
+                convert_and_plot_12bpp(
+                    sensor_data,
+                    save_spectrum=save,
+                    dark_frame_file=dark_frame_file,
+                    plot=plot,
+                )
+                print(session.report())
+            except serial.SerialException as e:
+                print(f"Serial port error: {e}")
+            except Exception as e:
+                print(f"An error occurred: {e}")
+    finally:
+        acquisition.stop(timeout=2)
+        session.close()
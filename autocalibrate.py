@@ -0,0 +1,269 @@
+import argparse
+import time
+
+import numpy as np
+
+from calibration import Calibration
+
+# Fluorescent lamp lines (nm): mercury, plus the phosphor lines picked by hand
+# for the legacy ER calibration
+fluorescent_lines = np.array(
+    [
+        404.66,
+        435.83,
+        487.7,
+        542.4,
+        546.07,
+        576.96,
+        579.07,
+        587.6,
+        593.4,
+        599.7,
+        611.6,
+        631.6,
+        650.8,
+        662.6,
+        687.7,
+        693.7,
+    ]
+)
+
+
+def line_centroids(spectrum, prominence=0.02, window=4, max_lines=40):
+    """
+    Sub-pixel centers and heights of the `max_lines` most prominent lines,
+    sorted by position. Each center is the centroid of the part of the line
+    above its half maximum, within `window` pixels of the top.
+    """
+    from scipy.signal import find_peaks
+
+    spectrum = np.asarray(spectrum, dtype=np.float64)
+    span = spectrum.max() - spectrum.min()
+    peaks, properties = find_peaks(spectrum, prominence=prominence * span)
+    strongest = np.argsort(properties["prominences"])[::-1][:max_lines]
+    peaks = np.sort(peaks[strongest])
+
+    offsets = np.arange(-window, window + 1)
+    pixels = np.clip(peaks[:, None] + offsets, 0, len(spectrum) - 1)
+    values = spectrum[pixels]
+    baseline = values.min(axis=1, keepdims=True)
+    top = spectrum[peaks][:, None]
+    weights = np.clip(values - (baseline + top) / 2, 0, None)
+    centers = (weights * pixels).sum(axis=1) / weights.sum(axis=1)
+    return centers, (top - baseline)[:, 0]
+
+
+def reference_lines(path, prominence=0.02, max_lines=40):
+    """
+    Line wavelengths of a reference lamp spectrum (x in nm, intensity), such
+    as Archive/fluorescent_bulb.csv.
+    """
+    from loader import read_spectrum
+
+    _, axis, _, intensity = read_spectrum(path)
+    centers, _ = line_centroids(intensity, prominence, max_lines=max_lines)
+    return np.interp(centers, np.arange(len(axis)), axis)
+
+
+def _pairs(n):
+    first, second = np.triu_indices(n, 1)
+    return first, second
+
+
+def match_lines(
+    centers,
+    lines,
+    tolerance=2.0,
+    dispersion=(0.01, 2.0),
+    max_hypotheses=50000,
+    seed=0,
+):
+    """
+    Pairs detected line centers (pixels) with reference wavelengths.
+
+    Every hypothesis maps two detected lines onto two reference lines, which
+    fixes a linear dispersion; hypotheses whose slope (nm per pixel) is
+    outside `dispersion` are discarded. All hypotheses are scored at once by
+    the number of detected lines that land within `tolerance` pixels of a
+    reference line. If there are more than `max_hypotheses` pairings a
+    random subset is scored (RANSAC). Returns (slope, intercept, inliers).
+    """
+    centers = np.asarray(centers, dtype=np.float64)
+    lines = np.sort(np.asarray(lines, dtype=np.float64))
+    if len(centers) < 2 or len(lines) < 2:
+        raise ValueError("Need at least two detected and two reference lines")
+
+    detected = np.column_stack(_pairs(len(centers)))
+    reference = np.column_stack(_pairs(len(lines)))
+    n_hypotheses = len(detected) * len(reference)
+    if n_hypotheses > max_hypotheses:
+        rng = np.random.default_rng(seed)
+        chosen = rng.choice(n_hypotheses, max_hypotheses, replace=False)
+    else:
+        chosen = np.arange(n_hypotheses)
+    d = detected[chosen // len(reference)]
+    r = reference[chosen % len(reference)]
+
+    slope = (lines[r[:, 1]] - lines[r[:, 0]]) / (centers[d[:, 1]] - centers[d[:, 0]])
+    keep = (slope >= dispersion[0]) & (slope <= dispersion[1])
+    slope = slope[keep]
+    intercept = lines[r[keep, 0]] - slope * centers[d[keep, 0]]
+    if not len(slope):
+        raise ValueError("No line pairing gives a dispersion in range")
+
+    # Distance (in pixels) from every predicted wavelength to its nearest line
+    predicted = slope[:, None] * centers + intercept[:, None]
+    right = np.clip(np.searchsorted(lines, predicted), 1, len(lines) - 1)
+    nearest = np.minimum(
+        np.abs(predicted - lines[right - 1]), np.abs(lines[right] - predicted)
+    )
+    distance = nearest / slope[:, None]
+    inliers = distance < tolerance
+    score = inliers.sum(axis=1) - np.where(inliers, distance, 0).sum(axis=1) / (
+        tolerance * len(centers)
+    )
+    best = np.argmax(score)
+    return slope[best], intercept[best], int(inliers[best].sum())
+
+
+def _assign(centers, lines, coefficients, tolerance):
+    """
+    Nearest reference line of every detected line within `tolerance`
+    pixels; each reference line is used at most once.
+    """
+    predicted = np.polyval(coefficients, centers)
+    slope = np.abs(np.polyval(np.polyder(coefficients), centers))
+    distance = np.abs(predicted[:, None] - lines[None, :]) / slope[:, None]
+    nearest = distance.argmin(axis=1)
+    close = distance[np.arange(len(centers)), nearest] < tolerance
+    pairs = {}
+    for i in np.flatnonzero(close):
+        j = nearest[i]
+        if j not in pairs or distance[i, j] < distance[pairs[j], j]:
+            pairs[j] = i
+    detected = np.array(sorted(pairs.values()), dtype=int)
+    return detected, nearest[detected]
+
+
+def auto_calibrate(
+    spectrum,
+    sensor,
+    laser_nm,
+    lines=fluorescent_lines,
+    session=None,
+    order=1,
+    tolerance=2.0,
+    search_tolerance=8.0,
+    dispersion=(0.01, 2.0),
+    prominence=0.02,
+):
+    """
+    Calibration from a lamp spectrum. Line centroids are matched to the
+    reference `lines` with a linear dispersion, loosely (`search_tolerance`
+    pixels) so that a curved dispersion is still found. A polynomial of
+    `order` is then fitted and the matching repeated with it, narrowing
+    down to `tolerance` pixels, until the set of matched lines is stable.
+    """
+    lines = np.sort(np.asarray(lines, dtype=np.float64))
+    centers, _ = line_centroids(spectrum, prominence)
+    slope, intercept, _ = match_lines(centers, lines, search_tolerance, dispersion)
+
+    coefficients = np.array([slope, intercept])
+    window = search_tolerance
+    detected = None
+    for _ in range(20):
+        matched, reference = _assign(centers, lines, coefficients, window)
+        if len(matched) < order + 2:
+            raise ValueError(f"Only {len(matched)} lines matched, need {order + 2}")
+        stable = detected is not None and np.array_equal(matched, detected)
+        if stable and window == tolerance:
+            break
+        detected = matched
+        coefficients = np.polyfit(centers[matched], lines[reference], order)
+        window = max(tolerance, window / 2)
+
+    points = np.column_stack([centers[matched], lines[reference]])
+    return Calibration.fit(points, len(spectrum), laser_nm, sensor, session, order)
+
+
+def synthetic_lamp(lines_path, coefficients, n_pixels=3694, noise=0.005, seed=0):
+    """
+    The reference lamp spectrum seen through a sensor with the given
+    pixel-to-wavelength polynomial, for benchmarking.
+    """
+    from loader import read_spectrum
+
+    _, axis, _, intensity = read_spectrum(lines_path)
+    wavelengths = np.polyval(coefficients, np.arange(n_pixels))
+    spectrum = np.interp(wavelengths, axis, intensity / intensity.max())
+    rng = np.random.default_rng(seed)
+    return spectrum + rng.normal(0, noise, n_pixels)
+
+
+def print_calibration(calibration):
+    print(calibration)
+    print(f"{'pixel':>9} {'line nm':>9} {'residual nm':>12}")
+    for (pixel, wavelength), residual in zip(calibration.points, calibration.residuals):
+        print(f"{pixel:9.2f} {wavelength:9.2f} {residual:12.3f}")
+    rms = np.sqrt(np.mean(calibration.residuals**2))
+    print(f"{len(calibration.points)} lines, rms residual {rms:.3f} nm")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate from a lamp spectrum")
+    parser.add_argument("spectrum", nargs="?", help="lamp spectrum CSV")
+    parser.add_argument("--sensor", default="er", choices=["er", "webcam"])
+    parser.add_argument("--laser", type=float, default=None, help="laser nm")
+    parser.add_argument("--session", default=None, help="saved as <sensor>-<session>")
+    parser.add_argument(
+        "--reference",
+        default=None,
+        help="reference lamp spectrum to take the lines from "
+        "(default: built-in fluorescent lamp lines)",
+    )
+    parser.add_argument("--order", type=int, default=1)
+    parser.add_argument("--tolerance", type=float, default=2.0, help="pixels")
+    parser.add_argument("--save", action="store_true")
+    args = parser.parse_args()
+
+    from loader import read_spectrum
+
+    laser = args.laser or {"er": 632.8, "webcam": 532.0}[args.sensor]
+    lines = fluorescent_lines
+    if args.reference:
+        lines = reference_lines(args.reference)
+
+    if args.spectrum:
+        intensity = read_spectrum(args.spectrum)[3]
+        t0 = time.perf_counter()
+        calibration = auto_calibrate(
+            intensity,
+            args.sensor,
+            laser,
+            lines,
+            args.session,
+            args.order,
+            args.tolerance,
+        )
+        print(f"Calibrated in {(time.perf_counter() - t0) * 1e3:.0f} ms")
+        print_calibration(calibration)
+        if args.save:
+            print(f"Saved {calibration.save()}")
+    else:
+        # Benchmark: the reference lamp through a known, slightly curved
+        # dispersion, recovered from its own line list
+        reference = args.reference or "Archive/fluorescent_bulb.csv"
+        lines = reference_lines(reference)
+        truth = np.array([-5e-7, 0.09, 400.0])
+        spectrum = synthetic_lamp(reference, truth)
+        t0 = time.perf_counter()
+        calibration = auto_calibrate(
+            spectrum, "er", laser, lines, order=max(args.order, 2)
+        )
+        elapsed = time.perf_counter() - t0
+        print_calibration(calibration)
+        error = np.abs(calibration.wavelengths - np.polyval(truth, calibration.pixels))
+        print(
+            f"Synthetic {reference}: calibrated in {elapsed * 1e3:.0f} ms, "
+            f"max wavelength error {error.max():.3f} nm"
+        )
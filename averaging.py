@@ -0,0 +1,239 @@
+import argparse
+import time
+
+import numpy as np
+
+BOXCAR = "boxcar"
+EMA = "ema"
+
+
+def band_mask(axis, low, high):
+    """
+    Boolean mask of the pixels whose axis value (pixel, wavelength or
+    wavenumber) lies between `low` and `high`.
+    """
+    axis = np.asarray(axis)
+    return (axis >= min(low, high)) & (axis <= max(low, high))
+
+
+class RunningStats:
+    """
+    Per-pixel running mean and variance (Welford's algorithm) without storing
+    the frames. All buffers are allocated once, so updates do not allocate.
+    """
+
+    def __init__(self, length):
+        self.n = 0
+        self.mean = np.zeros(length)
+        self.m2 = np.zeros(length)  # sum of squared deviations from the mean
+        self._delta = np.empty(length)
+        self._scratch = np.empty(length)
+
+    def reset(self):
+        self.n = 0
+        self.mean[:] = 0
+        self.m2[:] = 0
+
+    def update(self, frame):
+        self.n += 1
+        np.subtract(frame, self.mean, out=self._delta)
+        np.multiply(self._delta, 1 / self.n, out=self._scratch)
+        self.mean += self._scratch
+        np.subtract(frame, self.mean, out=self._scratch)
+        self._scratch *= self._delta
+        self.m2 += self._scratch
+
+    def variance(self):
+        if self.n < 2:
+            return np.full_like(self.mean, np.inf)
+        return self.m2 / (self.n - 1)
+
+    def stderr(self):
+        """
+        Standard error of the mean spectrum, usable as fit weights.
+        """
+        return np.sqrt(self.variance() / max(self.n, 1))
+
+    def snr(self, band=None, reference=0):
+        """
+        Summed mean signal in `band` (mask or slice) over its standard error.
+        Signal is counted from `reference`, e.g. 4095 for the inverted frames
+        of the CH341 board.
+        """
+        if self.n < 2:
+            return 0.0
+        band = slice(None) if band is None else band
+        signal = np.sum(self.mean[band] - reference)
+        noise = np.sqrt(np.sum(self.m2[band]) / ((self.n - 1) * self.n))
+        return abs(signal) / noise if noise > 0 else np.inf
+
+
+class TemporalAverage:
+    """
+    Average of a stream of spectra over the last `window` frames, at a cost
+    per frame independent of the window.
+
+    Boxcar mode keeps the last `max_window` frames in a ring buffer and a
+    running sum of the window. EMA mode is an exponential moving average
+    with alpha = 2 / (window + 1). During warm-up both are the average of
+    the frames seen so far. Both are updated every frame, so `window` and
+    `mode` can be changed at any time without reallocating or restarting.
+    """
+
+    def __init__(self, length, window=1, mode=BOXCAR, max_window=256):
+        self.max_window = max_window
+        self.frames = np.zeros((max_window, length))
+        self.sum = np.zeros(length)
+        self.ema = np.zeros(length)  # not normalized, see ema_weight
+        self.ema_weight = 0.0
+        self.mean = np.zeros(length)
+        self._scratch = np.empty(length)
+        self.written = 0
+        self.n = 0  # frames in the boxcar window
+        self._window = 1
+        self.window = window
+        self.mode = mode
+
+    @property
+    def window(self):
+        return self._window
+
+    @window.setter
+    def window(self, window):
+        if not 1 <= window <= self.max_window:
+            raise ValueError(f"window must be between 1 and {self.max_window}")
+        self._window = int(window)
+        self._resum()
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        if mode not in (BOXCAR, EMA):
+            raise ValueError(f"Unknown averaging mode {mode!r}")
+        self._mode = mode
+
+    def _resum(self):
+        # Sum of the newest min(window, written) frames still in the buffer
+        self.n = min(self._window, self.written)
+        rows = (self.written - 1 - np.arange(self.n)) % self.max_window
+        np.sum(self.frames[rows], axis=0, out=self.sum)
+
+    def reset(self):
+        self.written = 0
+        self.n = 0
+        self.sum[:] = 0
+        self.ema[:] = 0
+        self.ema_weight = 0.0
+
+    def update(self, frame):
+        """
+        Adds a frame and returns the current average. The returned array is
+        reused by the next call.
+        """
+        slot = self.written % self.max_window
+        if self.n == self._window:
+            self.sum -= self.frames[(self.written - self.n) % self.max_window]
+        else:
+            self.n += 1
+        self.frames[slot] = frame
+        self.sum += self.frames[slot]
+        self.written += 1
+        if slot == self.max_window - 1:
+            self._resum()  # drop the rounding error the running sum accumulates
+
+        alpha = 2 / (self._window + 1)
+        self.ema *= 1 - alpha
+        np.multiply(self.frames[slot], alpha, out=self._scratch)
+        self.ema += self._scratch
+        self.ema_weight = (1 - alpha) * self.ema_weight + alpha
+
+        if self._mode == BOXCAR:
+            np.divide(self.sum, self.n, out=self.mean)
+        else:
+            np.divide(self.ema, self.ema_weight, out=self.mean)
+        return self.mean
+
+
+def average_until(
+    read_frame,
+    length,
+    max_frames=None,
+    target_snr=None,
+    band=None,
+    time_budget=None,
+    reference=0,
+    min_frames=2,
+    stats=None,
+    max_failures=10,
+):
+    """
+    Averages frames from `read_frame()` until `target_snr` is reached in
+    `band` (see RunningStats.snr), `time_budget` seconds have passed or
+    `max_frames` were taken, whichever comes first.
+    Returns (mean, stderr, n_frames).
+
+    `read_frame` returns None for a failed read (e.g. a short frame); it is
+    skipped rather than averaged, at least one frame is always taken, and
+    IOError is raised after `max_failures` failed reads in a row.
+
+    Pass a RunningStats as `stats` to reuse its buffers between calls; the
+    returned mean is then only valid until the next call.
+    """
+    if max_frames is None and target_snr is None and time_budget is None:
+        raise ValueError("average_until needs max_frames, target_snr or time_budget")
+    if stats is None:
+        stats = RunningStats(length)
+    stats.reset()
+
+    start_time = time.monotonic()
+    failures = 0
+    while True:
+        frame = read_frame()
+        if frame is None:
+            failures += 1
+            if failures >= max_failures:
+                raise IOError(f"{failures} failed reads in a row")
+            continue
+        failures = 0
+        stats.update(frame)
+        if max_frames is not None and stats.n >= max_frames:
+            break
+        if time_budget is not None and time.monotonic() - start_time >= time_budget:
+            break
+        if target_snr is not None and stats.n >= min_frames:
+            if stats.snr(band, reference) >= target_snr:
+                break
+    return stats.mean, stats.stderr(), stats.n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Temporal averaging benchmark")
+    parser.add_argument("--length", type=int, default=1920)
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    stream = rng.normal(100, 10, (args.frames, args.length))
+    print(f"Per frame, {args.length} pixels:")
+    for window in (1, 16, 64, 256):
+        # The (length, rolling) matrix analyzer.py averaged every frame
+        roll = np.zeros((args.length, window))
+        t0 = time.perf_counter()
+        for i, frame in enumerate(stream):
+            roll[:, i % window] = frame
+            np.average(roll, axis=1)
+        before = (time.perf_counter() - t0) / args.frames
+
+        average = TemporalAverage(args.length, window)
+        t0 = time.perf_counter()
+        for frame in stream:
+            mean = average.update(frame)
+        after = (time.perf_counter() - t0) / args.frames
+        assert np.allclose(mean, stream[-window:].mean(axis=0))
+        print(
+            f"  window {window:3d}: np.average {before * 1e6:7.1f} us, "
+            f"running sum {after * 1e6:6.1f} us"
+        )
@@ -0,0 +1,204 @@
+import argparse
+import time
+from functools import lru_cache
+
+import numpy as np
+
+smoothness = 1e5  # default penalty (lambda) on the baseline's second difference
+ARPLS = "arpls"
+ALS = "als"
+# ALS is the default: the webcam spectra are clipped at 0 after dark
+# subtraction and are mostly exact or near zeros, so arPLS sees almost no
+# noise in its negative residuals, treats the fluorescence hump as signal
+# and fits a baseline of ~0 under it. ALS follows the hump. arPLS is
+# closer on unclipped CCD spectra.
+default_method = ALS
+
+
+@lru_cache(maxsize=16)
+def penalty_bands(n_pixels, lam, order=2):
+    """
+    lam * D^T D for the `order`-th difference matrix D, in the lower banded
+    storage used by LAPACK's banded Cholesky (pbsv), diagonal first; pbsv
+    runs faster on it than on the upper storage.
+    """
+    from scipy import sparse
+
+    D = sparse.diags(
+        np.diff(np.eye(order + 1), order, axis=0)[0],
+        np.arange(order + 1),
+        shape=(n_pixels - order, n_pixels),
+    )
+    penalty = (lam * (D.T @ D)).todia()
+    bands = np.zeros((order + 1, n_pixels))
+    for k in range(order + 1):
+        diagonal = penalty.diagonal(k)
+        bands[k, : n_pixels - k] = diagonal
+    bands.setflags(write=False)
+    return bands
+
+
+@lru_cache(maxsize=16)
+def uniform_factor(n_pixels, lam, order=2):
+    """
+    Cholesky factor of I + lam * D^T D, the system of the first iteration,
+    where every pixel still has weight 1.
+    """
+    from scipy.linalg import cholesky_banded
+
+    bands = penalty_bands(n_pixels, lam, order).copy()
+    bands[0] += 1
+    factor = cholesky_banded(bands, lower=True)
+    factor.setflags(write=False)
+    return factor
+
+
+def _weights(spectrum, fitted, method, p):
+    residual = spectrum - fitted
+    if method == ALS:
+        return np.where(residual > 0, p, 1 - p)
+    # arPLS: logistic weights from the statistics of the negative residuals
+    negative = residual[residual < 0]
+    if len(negative) < 2:
+        return np.ones_like(residual)
+    mean, std = negative.mean(), negative.std()
+    exponent = np.clip(2 * (residual - (2 * std - mean)) / max(std, 1e-12), -50, 50)
+    return 1 / (1 + np.exp(exponent))
+
+
+def _solve(bands, weights, rhs):
+    """
+    Solves (W + lam D^T D) z = rhs for one or (as columns) many right-hand
+    sides sharing the weights, with one banded Cholesky factorization.
+    """
+    from scipy.linalg.lapack import dpbsv
+
+    system = bands.copy()
+    system[0] += weights
+    _, fitted, info = dpbsv(system, rhs, lower=1, overwrite_ab=1, overwrite_b=1)
+    if info != 0:
+        raise np.linalg.LinAlgError(f"Baseline system is singular ({info})")
+    return fitted
+
+
+def _iterate(spectrum, fitted, weights, bands, method, p, tol, max_iter):
+    """
+    Reweights and refits one spectrum from (fitted, weights) until the
+    weights settle. Returns the baseline and its final weights.
+    """
+    for _ in range(max_iter):
+        new_weights = _weights(spectrum, fitted, method, p)
+        change = np.linalg.norm(new_weights - weights) / np.linalg.norm(weights)
+        weights = new_weights
+        if change < tol:
+            break
+        fitted = _solve(bands, weights, weights * spectrum)
+    return fitted, weights
+
+
+def estimate_baseline(
+    spectra,
+    lam=smoothness,
+    method=default_method,
+    p=0.01,
+    tol=1e-2,
+    max_iter=50,
+    order=2,
+):
+    """
+    Baseline of one spectrum or of every row of a (n_spectra, n_pixels)
+    stack, by asymmetric least squares (ALS, with asymmetry `p`) or
+    asymmetrically reweighted penalized least squares (arPLS, Baek et al.
+    2015).
+
+    Each iteration solves (W + lam D^T D) z = W y as a banded system in
+    O(n_pixels); the factorization is most of the cost. The penalty bands
+    and the factorization of the first, unweighted, iteration are cached
+    per (n_pixels, lam). In a stack, the first row is fitted from there,
+    and its final weights start every other row: all of them are solved
+    with one factorization, leaving a few reweighting steps per row.
+    """
+    from scipy.linalg import cho_solve_banded
+
+    spectra = np.asarray(spectra, dtype=np.float64)
+    single = spectra.ndim == 1
+    spectra = np.atleast_2d(spectra)
+    n_pixels = spectra.shape[1]
+    args = (penalty_bands(n_pixels, float(lam), order), method, p, tol, max_iter)
+
+    factor = uniform_factor(n_pixels, float(lam), order)
+    baselines = np.empty_like(spectra)
+    baselines[0], weights = _iterate(
+        spectra[0],
+        cho_solve_banded((factor, True), spectra[0]),
+        np.ones(n_pixels),
+        *args,
+    )
+    if len(spectra) > 1:
+        rest = _solve(args[0], weights, weights[:, None] * spectra[1:].T).T
+        for row in range(1, len(spectra)):
+            baselines[row], _ = _iterate(spectra[row], rest[row - 1], weights, *args)
+    return baselines[0] if single else baselines
+
+
+def remove_baseline(spectra, lam=smoothness, method=default_method, **kwargs):
+    """
+    Spectra with their fluorescence background subtracted.
+    """
+    spectra = np.asarray(spectra, dtype=np.float64)
+    return spectra - estimate_baseline(spectra, lam, method, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Baseline removal benchmark")
+    parser.add_argument(
+        "files",
+        nargs="*",
+        default=["Data/paper_fluoress.csv", "Data/cloth_fluoresc.csv"],
+    )
+    parser.add_argument("--lam", type=float, default=smoothness)
+    parser.add_argument("--method", default=default_method, choices=[ARPLS, ALS])
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--plot", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x = np.arange(3694)
+    background = 2000 * np.exp(-(((x - 1500) / 1500) ** 2))
+    lines = sum(
+        h * np.exp(-(((x - c) / 4) ** 2))
+        for c, h in ((600, 800), (1800, 500), (2900, 300))
+    )
+    stack = background + lines + rng.normal(0, 10, (args.batch, len(x)))
+
+    estimate_baseline(stack[0], args.lam, args.method)
+    t0 = time.perf_counter()
+    estimate_baseline(stack[0], args.lam, args.method)
+    single = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    fitted = estimate_baseline(stack, args.lam, args.method)
+    batch = time.perf_counter() - t0
+    error = np.abs(fitted - background).mean()
+    print(
+        f"3694 pixels: {single * 1e3:.2f} ms single, {batch / args.batch * 1e3:.2f} ms "
+        f"per spectrum in a batch of {args.batch}, mean error {error:.1f} counts"
+    )
+
+    if args.files:
+        from loader import load_files
+
+        spectra = load_files(args.files)
+        if args.plot:
+            import matplotlib.pyplot as plt
+
+            fig, axes = plt.subplots(len(spectra), 1, sharex=True)
+        for i, (path, (_, axis, _, intensity)) in enumerate(zip(args.files, spectra)):
+            fitted = estimate_baseline(intensity, args.lam, args.method)
+            share = fitted.sum() / intensity.sum()
+            print(f"{path}: baseline is {share:.0%} of the signal")
+            if args.plot:
+                axes[i].plot(axis, intensity, label=path)
+                axes[i].plot(axis, fitted, "--", label="baseline")
+                axes[i].legend()
+        if args.plot:
+            plt.show()
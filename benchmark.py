@@ -0,0 +1,365 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from tcd1304 import (
+    bytes_expected,
+    ch341_length,
+    decode_12bpp,
+    decode_frames,
+    er_packet,
+    length,
+    read_into,
+)
+
+stages = ("request", "transfer", "decode", "post")
+
+# Entry points timed by bench_startup and the modules that make startup slow
+entry_points = (
+    "core",
+    "loader",
+    "draw",
+    "transmittance",
+    "calibrate",
+    "analyzer_ccd",
+    "analyzer_live",
+)
+heavy_modules = ("matplotlib", "scipy", "pandas", "serial", "cv2", "tkinter")
+
+# Run in a fresh interpreter: import one module and report what it cost
+startup_probe = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"import_ms": elapsed * 1e3, "heavy": heavy}}))
+"""
+
+
+def decode_loop(buffer):
+    """
+    Per-pixel decode previously used by analyzer_ccd.py and analyzer_live.py.
+    """
+    rxData16 = np.zeros(length, np.uint16)
+    for rxi in range(length):
+        rxData16[rxi] = (buffer[2 * rxi + 1] << 8) + buffer[2 * rxi]
+    return rxData16
+
+
+def time_per_call(func, *args, repeats=200):
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        func(*args)
+    return (time.perf_counter() - t0) / repeats
+
+
+def bench_decode(n_frames=100):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 4096, (n_frames, length), dtype=np.uint16)
+    stack = frames.astype("<u2").tobytes()
+    buffer = stack[:bytes_expected]
+
+    assert np.array_equal(decode_loop(buffer), decode_12bpp(buffer))
+    assert np.array_equal(decode_frames(stack), frames)
+
+    loop = time_per_call(decode_loop, buffer, repeats=20)
+    view = time_per_call(decode_12bpp, buffer)
+    batch = time_per_call(decode_frames, stack) / n_frames
+
+    print("Decode time per frame:")
+    print(f"  python loop:    {loop * 1e6:10.2f} us")
+    print(f"  frombuffer:     {view * 1e6:10.2f} us  ({loop / view:.0f}x)")
+    print(f"  stack of {n_frames}:   {batch * 1e6:10.2f} us  ({loop / batch:.0f}x)")
+    return {"loop_us": loop * 1e6, "frombuffer_us": view * 1e6, "stack_us": batch * 1e6}
+
+
+def summarize(timings, wall_time):
+    """
+    p50/p95/p99 per stage in milliseconds and the sustained frame rate.
+    """
+    timings = np.asarray(timings) * 1e3
+    summary = {"fps": len(timings) / wall_time, "stages": {}}
+    for name, column in zip(stages, timings.T):
+        p50, p95, p99 = np.percentile(column, [50, 95, 99])
+        summary["stages"][name] = {"p50": p50, "p95": p95, "p99": p99}
+    return summary
+
+
+def run_serial(ser, request, nbytes, decode, post, n_frames):
+    """
+    Times request, transfer, decode and post-processing for `n_frames` frames,
+    after one untimed warm-up frame.
+    """
+    buffer = bytearray(nbytes)
+    timings = np.zeros((n_frames, len(stages)))
+    for i in range(-1, n_frames):
+        if i == 0:
+            start = time.perf_counter()
+        t0 = time.perf_counter()
+        ser.reset_input_buffer()
+        ser.write(request)
+        t1 = time.perf_counter()
+        status = read_into(ser, buffer, timeout=5)
+        t2 = time.perf_counter()
+        if not status.complete:
+            print(f"Warning: {status}")
+        data = decode(buffer)
+        t3 = time.perf_counter()
+        post(data)
+        t4 = time.perf_counter()
+        if i >= 0:
+            timings[i] = (t1 - t0, t2 - t1, t3 - t2, t4 - t3)
+    return summarize(timings, time.perf_counter() - start)
+
+
+def post_er(sensor_data):
+    # convert_and_plot_12bpp in analyzer_ccd.py without the plot
+    from core import process_er_frame, smooth
+
+    return smooth(process_er_frame(sensor_data))
+
+
+def post_ch341(sensor_data, full_scale):
+    from core import process_ch341_frame
+
+    return process_ch341_frame(sensor_data, full_scale)
+
+
+def bench_serial(n_frames, pace=False, baudrate=None):
+    import serial
+
+    from simulator import SensorSimulator
+
+    results = {}
+    with SensorSimulator("er", pace=pace, baudrate=baudrate, seed=0) as sim:
+        ser = serial.Serial(sim.port, 115200)
+        results["er"] = run_serial(
+            ser,
+            er_packet(20, 20000, 1),
+            bytes_expected,
+            decode_12bpp,
+            post_er,
+            n_frames,
+        )
+        ser.close()
+
+    with SensorSimulator("ch341", pace=pace, baudrate=baudrate, seed=0) as sim:
+        ser = serial.Serial(sim.port, 921600)
+        results["ch341_12bpp"] = run_serial(
+            ser,
+            bytes([0xA1, 0xB8]),
+            2 * ch341_length,
+            lambda buffer: np.frombuffer(buffer, dtype=np.uint16) & 0x0FFF,
+            lambda data: post_ch341(data, 4095),
+            n_frames,
+        )
+        results["ch341_8bpp"] = run_serial(
+            ser,
+            bytes([0xA2]),
+            ch341_length,
+            lambda buffer: np.frombuffer(buffer, dtype=np.uint8),
+            lambda data: post_ch341(data.astype(np.float64), 255),
+            n_frames,
+        )
+        ser.close()
+    return results
+
+
+def bench_webcam(n_frames, width=1920, height=1080):
+    """
+    ROI extraction and baseline removal from analyzer.py on synthetic 1080p
+    raw YUYV frames. The frame copy stands in for cap.read().
+    """
+    from baseline import remove_baseline
+    from webcam import RoiReducer, roi_rows
+
+    rng = np.random.default_rng(0)
+    source = rng.integers(0, 256, (1, height * width * 2), dtype=np.uint8)
+    dark_intensities = np.zeros(width)
+    reducer = RoiReducer(roi_rows(height), width)
+    remove_baseline(dark_intensities)  # scipy import and cached factors
+
+    timings = np.zeros((n_frames, len(stages)))
+    start = time.perf_counter()
+    for i in range(n_frames):
+        t0 = time.perf_counter()
+        frame = source.copy()
+        t1 = time.perf_counter()
+        spectrum = reducer(frame)
+        t2 = time.perf_counter()
+        data = spectrum - dark_intensities
+        np.clip(remove_baseline(data), 0, None)
+        t3 = time.perf_counter()
+        timings[i] = (0.0, t1 - t0, t2 - t1, t3 - t2)
+    return summarize(timings, time.perf_counter() - start)
+
+
+def bench_startup(modules=entry_points, source=".", repeats=3):
+    """
+    Cold import time of each entry point, best of `repeats` fresh
+    interpreters, and the heavy modules the import pulled in. matplotlib
+    runs headless so scripts that plot on import (calibrate.py) can be timed.
+    """
+    env = dict(os.environ, MPLBACKEND="Agg")
+    results = {}
+    for module in modules:
+        probe = startup_probe.format(module=module, heavy=heavy_modules)
+        runs = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            done = subprocess.run(
+                [sys.executable, "-c", probe],
+                cwd=source,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            wall = time.perf_counter() - t0
+            if done.returncode != 0:
+                error = (done.stderr.strip().splitlines() or ["exited"])[-1]
+                runs = [{"error": error}]
+                break
+            run = json.loads(done.stdout.strip().splitlines()[-1])
+            run["wall_ms"] = wall * 1e3
+            runs.append(run)
+        results[module] = min(runs, key=lambda run: run.get("wall_ms", 0))
+    return results
+
+
+def print_startup(results, baseline=None):
+    print("\nStartup (best of fresh interpreters):")
+    for module, run in results.items():
+        old = (baseline or {}).get(module)
+        if "error" in run:
+            print(f"  {module:<14} failed: {run['error']}")
+            continue
+        line = (
+            f"  {module:<14} import {run['import_ms']:7.1f} ms  "
+            f"process {run['wall_ms']:7.1f} ms"
+        )
+        if old and "error" not in old:
+            speedup = old["import_ms"] / run["import_ms"]
+            line += f"  (was {old['import_ms']:7.1f} ms, {speedup:.1f}x)"
+        print(line)
+        print(f"  {'':<14} loads: {', '.join(run['heavy']) or 'numpy only'}")
+
+
+def startup_baseline(revision, modules=entry_points, repeats=3):
+    """
+    bench_startup on a temporary worktree checked out at `revision`.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        tree = os.path.join(root, "tree")
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", tree, revision],
+            check=True,
+            capture_output=True,
+        )
+        try:
+            return bench_startup(modules, tree, repeats)
+        finally:
+            subprocess.run(
+                ["git", "worktree", "remove", "--force", tree], capture_output=True
+            )
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    for path, summary in results.items():
+        print(f"\n{path}: {summary['fps']:.1f} frames/s")
+        for name, p in summary["stages"].items():
+            print(
+                f"  {name:<9} p50 {p['p50']:8.3f} ms  "
+                f"p95 {p['p95']:8.3f} ms  p99 {p['p99']:8.3f} ms"
+            )
+
+
+def compare(results, baseline, threshold=1.2, min_delta=0.05):
+    """
+    Prints p50 changes against a previous results file. A stage slower than
+    `threshold` times the baseline, and by more than `min_delta` ms, is flagged
+    as a regression.
+    """
+    print(f"\nCompared with {baseline.get('commit')}:")
+    for path, summary in results.items():
+        old = baseline["results"].get(path)
+        if old is None:
+            continue
+        for name, p in summary["stages"].items():
+            before = old["stages"][name]["p50"]
+            if before <= 0:
+                continue
+            ratio = p["p50"] / before
+            slower = ratio > threshold and p["p50"] - before > min_delta
+            flag = "  REGRESSION" if slower else ""
+            print(f"  {path}/{name:<9} {before:8.3f} -> {p['p50']:8.3f} ms{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Acquisition benchmarks")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--pace", action="store_true", help="simulate integration")
+    parser.add_argument("--baud", type=int, default=None, help="simulate UART pacing")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--compare", default=None, help="previous results JSON")
+    parser.add_argument(
+        "--startup", action="store_true", help="only time entry point imports"
+    )
+    parser.add_argument(
+        "--startup-baseline",
+        default=None,
+        metavar="REV",
+        help="also time the imports at a git revision",
+    )
+    args = parser.parse_args()
+
+    if args.startup or args.startup_baseline:
+        startup = bench_startup()
+        baseline = None
+        if args.startup_baseline:
+            baseline = startup_baseline(args.startup_baseline)
+            print(f"\nAt {args.startup_baseline}:")
+            print_startup(baseline)
+        print_startup(startup, baseline)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"commit": git_commit(), "startup": startup}, f, indent=2)
+        sys.exit()
+
+    results = {"decode": bench_decode()}
+    results["results"] = bench_serial(args.frames, args.pace, args.baud)
+    results["results"]["webcam"] = bench_webcam(args.frames)
+    print_results(results["results"])
+
+    results.update(
+        commit=git_commit(),
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        frames=args.frames,
+    )
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results["results"], json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
@@ -1,31 +1,31 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
-# Your data points
-from analyzer_ccd import points
+from calibration import load_calibration
 
-# Separate x and y values
-pixels = points[:, 0]
-wavelengths = points[:, 1]
-
-# Calculate linear fit
-slope, intercept = np.polyfit(pixels, wavelengths, 1)
+# Saved calibration to inspect (see calibration.py)
+calibration = load_calibration("er")
 
+# Separate x and y values
+pixels = calibration.points[:, 0]
+wavelengths = calibration.points[:, 1]
+slope, intercept = calibration.coefficients[-2:]
 
 
 def pixel_to_wavelength(pixel):
-    return slope * pixel + intercept
+    return np.polyval(calibration.coefficients, pixel)
 
 
 pixel_range = np.linspace(pixels.min(), pixels.max(), 100)
 wavelength_fit = pixel_to_wavelength(pixel_range)
+rms = np.sqrt(np.mean(calibration.residuals**2))
 
 plt.figure(figsize=(10, 6))
 plt.plot(
     pixel_range,
     wavelength_fit,
     "b-",
-    label=f"Linear fit (y = {slope:.3f}x + {intercept:.1f})",
+    label=f"Linear fit (y = {slope:.3f}x + {intercept:.1f}, rms {rms:.2f} nm)",
 )
 plt.plot(pixels, wavelengths, "ro", label="Measured points", alpha=0.5)
 plt.xlabel("Pixel Position")
@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+calibration_dir = Path(__file__).resolve().parent / "calibrations"
+
+# Reference points (pixel, wavelength in nm) the saved calibrations were
+# fitted from. `python calibration.py` writes them to calibration_dir.
+defaults = {
+    ("er", None): dict(
+        n_pixels=3694,
+        laser_nm=632.8,
+        points=[
+            [388.6, 667.43],
+            [524, 673.27],
+            [714, 682.46],
+            [1084, 696.83],
+            [3164, 773.83],
+            [3226, 776.23],
+            [3323, 779.86],
+        ],
+        # new optical system slope:
+        # [[292.2, 542.2], [379.2, 546.5], [1550, 599.7], [1820, 611.6]]
+    ),
+    # Previous optics as used by analyzer_live.py: the slope of these lines,
+    # with the laser line pinned at pixel 9.25
+    ("er", "legacy"): dict(
+        n_pixels=3694,
+        laser_nm=632.8,
+        points=[
+            [19, 587.6],
+            [127, 593.4],
+            [262, 599.7],
+            [501, 611.6],
+            [920, 631.6],
+            [962.5, 632.80],
+            [1358, 650.8],
+            [1638, 662.6],
+            [2276, 687.7],
+            [2439, 693.7],
+        ],
+        anchor=(9.25, 632.8),
+        shift=9.25 - 962.5,
+    ),
+    ("webcam", None): dict(
+        n_pixels=1920,
+        laser_nm=532,
+        coefficients=[0.5378783977636364, 251.83884117409121],
+    ),
+}
+
+
+class Calibration:
+    """
+    Pixel to wavelength polynomial of one sensor (and optionally one
+    session), with the wavelength and Raman shift axes and their Jacobians
+    precomputed for every pixel.
+    """
+
+    def __init__(
+        self,
+        coefficients,
+        n_pixels,
+        laser_nm,
+        sensor,
+        session=None,
+        points=None,
+        residuals=None,
+    ):
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.order = len(self.coefficients) - 1
+        self.n_pixels = int(n_pixels)
+        self.laser_nm = float(laser_nm)
+        self.sensor = sensor
+        self.session = session
+        self.points = None if points is None else np.asarray(points, dtype=np.float64)
+        self.residuals = None if residuals is None else np.asarray(residuals)
+
+        self.pixels = np.arange(self.n_pixels, dtype=np.float64)
+        self.wavelengths = np.polyval(self.coefficients, self.pixels)
+        self.laser_wavenumber = 1e7 / self.laser_nm
+        self.raman_wavenumbers = self.laser_wavenumber - 1e7 / self.wavelengths
+        # nm and cm^-1 per pixel
+        self.wavelength_jacobian = np.polyval(
+            np.polyder(self.coefficients), self.pixels
+        )
+        self.wavenumber_jacobian = 1e7 / self.wavelengths**2 * self.wavelength_jacobian
+
+    @classmethod
+    def fit(
+        cls, points, n_pixels, laser_nm, sensor, session=None, order=1, anchor=None
+    ):
+        """
+        Least-squares polynomial through (pixel, wavelength) points. With
+        `anchor` = (pixel, wavelength), e.g. the laser line, the constant
+        term is shifted so the polynomial passes through it.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        coefficients = np.polyfit(points[:, 0], points[:, 1], order)
+        if anchor is not None:
+            coefficients[-1] += anchor[1] - np.polyval(coefficients, anchor[0])
+        residuals = points[:, 1] - np.polyval(coefficients, points[:, 0])
+        return cls(coefficients, n_pixels, laser_nm, sensor, session, points, residuals)
+
+    def per_wavenumber(self, intensity):
+        """
+        Counts per pixel to counts per cm^-1.
+        """
+        return intensity / np.abs(self.wavenumber_jacobian)
+
+    def per_wavelength(self, intensity):
+        """
+        Counts per pixel to counts per nm.
+        """
+        return intensity / np.abs(self.wavelength_jacobian)
+
+    def for_pixels(self, n_pixels):
+        """
+        The same calibration for a readout of `n_pixels` spanning the same
+        detector (e.g. a webcam frame at another resolution).
+        """
+        scale = self.n_pixels / n_pixels
+        coefficients = self.coefficients * scale ** np.arange(self.order, -1, -1)
+        return Calibration(
+            coefficients, n_pixels, self.laser_nm, self.sensor, self.session
+        )
+
+    def to_dict(self):
+        return {
+            "sensor": self.sensor,
+            "session": self.session,
+            "order": self.order,
+            "n_pixels": self.n_pixels,
+            "laser_nm": self.laser_nm,
+            "coefficients": self.coefficients.tolist(),
+            "points": None if self.points is None else self.points.tolist(),
+            "residuals": None if self.residuals is None else self.residuals.tolist(),
+        }
+
+    def save(self, path=None):
+        path = Path(path or calibration_path(self.sensor, self.session))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), indent=2) + "\n")
+        _loaded.pop(str(path), None)
+        return path
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["coefficients"],
+            data["n_pixels"],
+            data["laser_nm"],
+            data["sensor"],
+            data.get("session"),
+            data.get("points"),
+            data.get("residuals"),
+        )
+
+    def __repr__(self):
+        name = self.sensor if self.session is None else f"{self.sensor}/{self.session}"
+        return (
+            f"Calibration({name}, order {self.order}, {self.n_pixels} px, "
+            f"{self.wavelengths[0]:.1f}-{self.wavelengths[-1]:.1f} nm)"
+        )
+
+
+def calibration_path(sensor, session=None):
+    name = sensor if session is None else f"{sensor}-{session}"
+    return calibration_dir / f"{name}.json"
+
+
+def build_default(sensor, session=None):
+    spec = dict(defaults[(sensor, session)])
+    if "coefficients" in spec:
+        return Calibration(
+            spec["coefficients"], spec["n_pixels"], spec["laser_nm"], sensor, session
+        )
+    points = np.asarray(spec["points"], dtype=np.float64)
+    points[:, 0] += spec.get("shift", 0)
+    return Calibration.fit(
+        points,
+        spec["n_pixels"],
+        spec["laser_nm"],
+        sensor,
+        session,
+        spec.get("order", 1),
+        spec.get("anchor"),
+    )
+
+
+_loaded = {}
+
+
+def load_calibration(sensor, session=None, path=None):
+    """
+    Saved calibration of `sensor` for `session` (None: the current one).
+    Calibrations are cached per file and reloaded only when it changes;
+    a missing built-in calibration is fitted from `defaults` and saved.
+    """
+    path = Path(path or calibration_path(sensor, session))
+    if not path.exists():
+        if (sensor, session) not in defaults:
+            raise FileNotFoundError(f"No calibration for {sensor} session {session}")
+        build_default(sensor, session).save(path)
+
+    key = str(path)
+    mtime = os.stat(key).st_mtime_ns
+    cached = _loaded.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, Calibration.from_dict(json.loads(path.read_text())))
+        _loaded[key] = cached
+    return cached[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the built-in calibrations")
+    parser.add_argument("--show", action="store_true", help="only print them")
+    args = parser.parse_args()
+
+    for sensor, session in defaults:
+        calibration = build_default(sensor, session)
+        if not args.show:
+            calibration.save()
+        rms = (
+            ""
+            if calibration.residuals is None
+            else f", rms residual {np.sqrt(np.mean(calibration.residuals**2)):.3f} nm"
+        )
+        print(f"{calibration}{rms}")
+
+    _loaded.clear()
+    t0 = time.perf_counter()
+    load_calibration("er")
+    first = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    load_calibration("er")
+    cached = time.perf_counter() - t0
+    print(f"Load: {first * 1e6:.0f} us from disk, {cached * 1e6:.0f} us cached")
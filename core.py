@@ -0,0 +1,73 @@
+import numpy as np
+
+length = 3694  # ER board pixels (7388 bytes / 2)
+gaussian_mag = 6  # default smoothing (sigma in pixels) of displayed spectra
+
+
+class TimingError(ValueError):
+    """
+    SH/ICG periods the TCD1304 cannot run with.
+    """
+
+
+def er_periods(SH, ICG):
+    """
+    SH and ICG in microseconds to the board's periods (0.5 us ticks).
+    """
+    return np.uint32(SH * 2), np.uint32(ICG * 2)
+
+
+def check_timing(SHperiod, ICGperiod):
+    """
+    Raises TimingError when the periods violate the sensor's timing rules.
+    """
+    if ICGperiod % SHperiod:
+        raise TimingError("TIMING VIOLATION: NOT DIVISIBLE")
+    if SHperiod < 20:
+        raise TimingError("TIMING VIOLATION: SH PERIOD TOO SMALL")
+    if ICGperiod < 14776:
+        raise TimingError("TIMING VIOLATION: ICG PERIOD TOO SMALL")
+
+
+def process_er_frame(sensor_data, balanced=False):
+    """
+    Raw ER frame to a spectrum: the frame is inverted against its dummy
+    pixels and flipped to increasing wavelength. With `balanced`, the
+    offset between the even and odd readout channels is removed.
+    """
+    sensor_data = (sensor_data[10] + sensor_data[11]) / 2 - sensor_data
+    sensor_data = np.flip(sensor_data)
+    if balanced:
+        offset = (
+            sensor_data[18]
+            + sensor_data[20]
+            + sensor_data[22]
+            + sensor_data[24]
+            - sensor_data[19]
+            - sensor_data[21]
+            - sensor_data[23]
+            - sensor_data[24]
+        ) / 4
+        sensor_data[0 : 2 * 1847 : 2] -= offset
+    return sensor_data
+
+
+def process_ch341_frame(sensor_data, full_scale=4095):
+    """
+    Raw CH341 frame to a spectrum: the board sends inverted counts, and the
+    first pixels are overwritten with pixel 5.
+    """
+    sensor_data = full_scale - np.asarray(sensor_data, dtype=np.float64)
+    sensor_data[0:4] = sensor_data[5]
+    return sensor_data
+
+
+def smooth(sensor_data, sigma=gaussian_mag):
+    """
+    Gaussian smoothing for display; sigma 0 returns the data unchanged.
+    """
+    if sigma == 0:
+        return sensor_data
+    from scipy.ndimage import gaussian_filter
+
+    return gaussian_filter(sensor_data, sigma)
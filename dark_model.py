@@ -0,0 +1,134 @@
+import argparse
+import re
+from pathlib import Path
+
+import numpy as np
+
+from darkframes import read_intensity_csv
+
+# Long dark acquisitions in the repo, named by integration time in seconds
+dark_files = ["240_dark.csv", "240_dark_large.csv", "80_dark_large.csv"]
+hot_threshold = 6  # robust z-score above which a pixel is flagged as hot
+
+
+def exposure_from_name(path):
+    """
+    Integration time in seconds from a leading number in the file name,
+    e.g. 240_dark_large.csv -> 240.
+    """
+    match = re.match(r"(\d+(?:\.\d+)?)", Path(path).stem)
+    if not match:
+        raise ValueError(f"No integration time in file name: {path}")
+    return float(match.group(1))
+
+
+class DarkModel:
+    """
+    Per-pixel dark model: dark = offset + rate * exposure, with SH as the
+    exposure.
+
+    Only SH is varied in the fit. The readout the dark frames were taken
+    with, the ICG/SH ratio and the number of averages, is part of the
+    model, and dark frames are only synthesized for that readout (the
+    repo's dark frames were taken with ICG = SH and no averaging).
+    """
+
+    def __init__(self, offset, rate, residual, hot, icg_ratio=1.0, averages=1):
+        self.offset = offset
+        self.rate = rate  # counts per second
+        self.residual = residual  # rms fit residual per pixel
+        self.hot = hot
+        self.icg_ratio = float(icg_ratio)  # ICG / SH of the fitted frames
+        self.averages = int(averages)
+
+    @classmethod
+    def fit(cls, frames, exposures, icg_ratio=1.0, averages=1):
+        """
+        Fits every pixel at once with one least-squares solve.
+        `frames` is (n_frames, n_pixels), `exposures` is in seconds.
+        """
+        frames = np.asarray(frames, dtype=np.float64)
+        exposures = np.asarray(exposures, dtype=np.float64)
+        if len(np.unique(exposures)) < 2:
+            raise ValueError("Need dark frames at two or more integration times")
+
+        design = np.column_stack([np.ones_like(exposures), exposures])
+        (offset, rate), *_ = np.linalg.lstsq(design, frames, rcond=None)
+        residual = np.sqrt(
+            np.mean((design @ np.vstack([offset, rate]) - frames) ** 2, axis=0)
+        )
+
+        # Hot pixels stand out from the median dark rate
+        deviation = rate - np.median(rate)
+        mad = 1.4826 * np.median(np.abs(deviation))
+        hot = deviation > hot_threshold * max(mad, 1e-12)
+        return cls(offset, rate, residual, hot, icg_ratio, averages)
+
+    @classmethod
+    def from_files(cls, paths, exposures=None, icg_ratio=1.0, averages=1):
+        if exposures is None:
+            exposures = [exposure_from_name(path) for path in paths]
+        frames = np.vstack([read_intensity_csv(path) for path in paths])
+        return cls.fit(frames, exposures, icg_ratio, averages)
+
+    def dark_frame(self, SH, ICG=None, averages=None):
+        """
+        Synthesized dark frame for SH and ICG periods given in microseconds,
+        as in analyzer_ccd.py and analyzer_live.py. Raises ValueError for a
+        readout (ICG/SH ratio, averages) other than the model's.
+        """
+        if ICG is not None and not np.isclose(ICG / SH, self.icg_ratio):
+            raise ValueError(
+                f"Dark model fitted at ICG = {self.icg_ratio:g} x SH, "
+                f"not {ICG / SH:g} x SH"
+            )
+        if averages is not None and int(averages) != self.averages:
+            raise ValueError(
+                f"Dark model fitted with {self.averages} averages, not {averages}"
+            )
+        return self.offset + self.rate * (SH / 1e6)
+
+    def save(self, path):
+        np.savez(
+            path,
+            offset=self.offset,
+            rate=self.rate,
+            residual=self.residual,
+            hot=self.hot,
+            icg_ratio=self.icg_ratio,
+            averages=self.averages,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            # Models saved before the readout was recorded: ICG = SH, 1 average
+            readout = {k: data[k] for k in ("icg_ratio", "averages") if k in data}
+            return cls(
+                data["offset"], data["rate"], data["residual"], data["hot"], **readout
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit a per-pixel dark model")
+    parser.add_argument("files", nargs="*", default=dark_files)
+    parser.add_argument(
+        "--exposures", type=float, nargs="*", help="integration times in seconds"
+    )
+    parser.add_argument(
+        "--icg-ratio", type=float, default=1.0, help="ICG / SH of the dark frames"
+    )
+    parser.add_argument("--averages", type=int, default=1)
+    parser.add_argument("--output", default="dark_model.npz")
+    args = parser.parse_args()
+
+    model = DarkModel.from_files(
+        args.files, args.exposures, args.icg_ratio, args.averages
+    )
+    model.save(args.output)
+    print(f"Fitted {len(model.rate)} pixels from {len(args.files)} dark frames")
+    print(f"Median offset: {np.median(model.offset):.1f} counts")
+    print(f"Median dark rate: {np.median(model.rate):.3f} counts/s")
+    print(f"Median residual: {np.median(model.residual):.1f} counts")
+    print(f"Hot pixels: {np.count_nonzero(model.hot)}")
+    print(f"Saved to {args.output}")
@@ -0,0 +1,89 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+cache_dir = Path(__file__).resolve().parent / ".cache" / "dark"
+
+
+def read_intensity_csv(path):
+    """
+    Reads the intensity column of a saved spectrum ("intensity" from the CCD
+    scripts, "Intensity" from analyzer.py) without going through pandas.
+    """
+    with open(path) as f:
+        header = f.readline().strip().lower().split(",")
+    column = header.index("intensity")
+    return np.loadtxt(path, delimiter=",", skiprows=1, usecols=column, ndmin=1)
+
+
+class DarkFrameStore:
+    """
+    Loads each dark frame once and hands out a ready float64 array.
+
+    Frames are keyed by (sensor, SH, ICG, averages). The first load parses the
+    CSV and writes a binary .npy copy to `cache_dir`; later loads memory-map
+    that copy. An entry is reloaded when the CSV changes on disk.
+
+    A fitted dark model (.npz from dark_model.py) can be given instead of a
+    CSV, in which case the frame is synthesized for the requested SH.
+    """
+
+    def __init__(self, cache_dir=cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.frames = {}  # key -> (path, stat signature, array)
+
+    def _binary_path(self, path):
+        digest = hashlib.sha1(str(Path(path).resolve()).encode()).hexdigest()[:8]
+        return self.cache_dir / f"{Path(path).stem}-{digest}.npy"
+
+    def _load(self, path, signature):
+        binary = self._binary_path(path)
+        try:
+            if binary.stat().st_mtime_ns >= signature[0]:
+                return np.load(binary, mmap_mode="r")
+        except (OSError, ValueError):
+            pass
+        dark_frame = read_intensity_csv(path).astype(np.float64)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = binary.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, dark_frame)
+        os.replace(tmp, binary)
+        return np.load(binary, mmap_mode="r")
+
+    def get(self, path, sensor="er", SH=None, ICG=None, averages=None):
+        key = (sensor, SH, ICG, averages)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self.frames.get(key)
+        if cached and cached[0] == path and cached[1] == signature:
+            return cached[2]
+        if Path(path).suffix == ".npz":
+            from dark_model import DarkModel
+
+            dark_frame = DarkModel.load(path).dark_frame(SH, ICG, averages)
+        else:
+            dark_frame = self._load(path, signature)
+        self.frames[key] = (path, signature, dark_frame)
+        return dark_frame
+
+    def subtract(
+        self, sensor_data, path, sensor="er", SH=None, ICG=None, averages=None
+    ):
+        """
+        Subtracts the dark frame from float `sensor_data` in place.
+        """
+        sensor_data -= self.get(path, sensor, SH, ICG, averages)
+        return sensor_data
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.frames.clear()
+        else:
+            self.frames.pop(key, None)
+
+
+# Shared store for the acquisition scripts
+dark_frames = DarkFrameStore()
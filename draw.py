@@ -1,16 +1,34 @@
-import tkinter as tk
+import warnings
 from pathlib import Path
-from tkinter import filedialog
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-from analyzer_ccd import gaussian_mag, raman_wavenumbers
-from scipy.ndimage import gaussian_filter
-
+from baseline import ARPLS, remove_baseline
+from calibration import load_calibration
+from core import gaussian_mag, smooth
+from loader import load_files
+
+raman_wavenumbers = load_calibration("er").raman_wavenumbers
+
+
+def plot_spectra(file_paths=None, marching_window=0, remove_fluorescence=False):
+    """
+    Plots CSV spectra against the ER Raman axis. `remove_fluorescence`
+    subtracts an arPLS baseline. `marching_window` is deprecated: it
+    subtracts a moving average of that many pixels, as before.
+    """
+    import matplotlib.pyplot as plt
+
+    if marching_window > 0:
+        warnings.warn(
+            "marching_window is deprecated, use remove_fluorescence=True",
+            DeprecationWarning,
+            stacklevel=2,
+        )
 
-def plot_spectra(file_paths=None, marching_window=0):
     if file_paths is None:
+        import tkinter as tk
+        from tkinter import filedialog
+
         root = tk.Tk()
         root.withdraw()  # Hide the main window
         file_paths = filedialog.askopenfilenames(
@@ -27,19 +45,27 @@ def plot_spectra(file_paths=None, marching_window=0):
 
     fig, ax = plt.subplots()
 
-    for file_path in file_paths:
+    # Parsed spectra are cached per directory, so reopening files is cheap;
+    # files that cannot be read are skipped with a warning
+    spectra = load_files(file_paths, skip=True)
+
+    for file_path, loaded in zip(file_paths, spectra):
+        if loaded is None:
+            continue
+        schema, _, _, sensor_data = loaded
         try:
-            df = pd.read_csv(file_path)
             filename = Path(file_path).stem
-            sensor_data = df["intensity"]
-            if gaussian_mag != 0:
-                sensor_data = gaussian_filter(sensor_data, gaussian_mag)
-
-            # Apply marching average subtraction if window size provided
-            if marching_window > 0:
+            if len(sensor_data) != len(raman_wavenumbers):
+                raise ValueError(f"{schema} spectrum does not match the CCD axis")
+            sensor_data = smooth(sensor_data, gaussian_mag)
+
+            # Subtract the fluorescence background; CCD spectra are not
+            # clipped at 0, so arPLS can be used here
+            if remove_fluorescence:
+                sensor_data = remove_baseline(sensor_data, method=ARPLS)
+            elif marching_window > 0:
                 window = np.ones(marching_window) / marching_window
-                background = np.convolve(sensor_data, window, mode="same")
-                sensor_data = sensor_data - background
+                sensor_data = sensor_data - np.convolve(sensor_data, window, "same")
 
             sensor_data -= np.min(sensor_data)
             ax.plot(
@@ -67,4 +93,4 @@ def normalize_spectrum(intensity):
 
 
 if __name__ == "__main__":
-    plot_spectra(marching_window=0)
+    plot_spectra(remove_fluorescence=False)
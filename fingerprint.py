@@ -0,0 +1,233 @@
+import argparse
+import time
+
+import numpy as np
+
+from similarity import Match, features, grid, laser_nm, raman_shift, resample
+
+n_peaks = 12  # strongest peaks kept per spectrum
+bin_width = 10.0  # cm^-1, also the matching tolerance
+baseline_window = 100  # grid points (200 cm^-1) for the rolling-minimum baseline
+
+
+def peak_positions(spectrum, grid=grid, n_peaks=n_peaks, prominence=0.05):
+    """
+    Raman shifts of the `n_peaks` most prominent peaks of a spectrum already
+    resampled onto `grid`. Prominence is relative to the tallest peak.
+    """
+    from scipy.ndimage import minimum_filter1d, uniform_filter1d
+    from scipy.signal import find_peaks
+
+    spectrum = np.asarray(spectrum, dtype=np.float64)
+    spectrum = spectrum - minimum_filter1d(spectrum, baseline_window)
+    spectrum = uniform_filter1d(spectrum, 3)
+    peaks, properties = find_peaks(
+        spectrum, prominence=prominence * max(spectrum.max(), 1e-12)
+    )
+    strongest = np.argsort(properties["prominences"])[::-1][:n_peaks]
+    return np.sort(grid[peaks[strongest]])
+
+
+def record_shift(record):
+    """
+    Raman shift axis of a SpectrumStore record, or None if it has no
+    wavelength calibration (CH341 board). The record's own calibration
+    coefficients are used when stored, otherwise its calibration session.
+    """
+    meta = record.metadata
+    if record.axis is not None:
+        return record.axis
+    sensor = meta.get("sensor")
+    if sensor not in ("webcam", "er"):
+        return None
+    laser = meta.get("laser_nm") or laser_nm[sensor]
+    coefficients = meta.get("calibration")
+    if coefficients:
+        wavelengths = np.polyval(coefficients, np.arange(len(record.intensity)))
+        return raman_shift(wavelengths, "nm", laser)
+    if sensor == "er":
+        from calibration import load_calibration
+
+        calibration = load_calibration("er", meta.get("calibration_session"))
+        return raman_shift(calibration.wavelengths, "nm", laser)
+    return None
+
+
+class FingerprintIndex:
+    """
+    Inverted index from quantized peak positions to spectrum IDs.
+
+    A query only scores the spectra sharing the most peaks with it (within
+    one bin) with the full cosine/Pearson/derivative comparison of
+    similarity.py, so lookup cost follows the candidate count rather than
+    the library size. Spectra can be added at any time.
+    """
+
+    def __init__(self, grid=grid, bin_width=bin_width):
+        self.grid = np.asarray(grid)
+        self.bin_width = bin_width
+        self.names = []
+        self.spectra = []  # resampled onto grid, kept for re-ranking
+        self.peaks = []
+        self.bins = {}  # bin -> list of spectrum IDs
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, spectrum, peaks=None):
+        """
+        Adds a spectrum already resampled onto the grid; returns its ID.
+        """
+        spectrum = np.asarray(spectrum, dtype=np.float32)
+        if peaks is None:
+            peaks = peak_positions(spectrum, self.grid)
+        peaks = np.asarray(peaks, dtype=np.float64)
+        index = len(self.names)
+        self.names.append(name)
+        self.spectra.append(spectrum)
+        self.peaks.append(peaks)
+        for b in np.unique(np.floor(peaks / self.bin_width).astype(int)):
+            self.bins.setdefault(int(b), []).append(index)
+        return index
+
+    def add_measured(self, name, intensity, shift):
+        return self.add(name, resample(intensity, shift, self.grid))
+
+    def candidates(self, peaks, max_candidates=50, min_overlap=2):
+        """
+        IDs sharing at least `min_overlap` peaks with `peaks`, most shared first.
+        """
+        if not len(self) or not len(peaks):
+            return np.array([], dtype=int)
+        # Only the postings of the touched bins are counted, so the cost
+        # follows the hits rather than the library size. A spectrum counts
+        # once per query peak, however many of the three bins it is in.
+        hits = []
+        for b in np.floor(np.asarray(peaks) / self.bin_width).astype(int):
+            hits.extend(
+                set().union(*(self.bins.get(int(n), ()) for n in (b - 1, b, b + 1)))
+            )
+        found, counts = np.unique(np.array(hits, dtype=int), return_counts=True)
+        keep = counts >= min(min_overlap, len(peaks))
+        found, counts = found[keep], counts[keep]
+        order = np.argsort(-counts, kind="stable")
+        return found[order[:max_candidates]]
+
+    def match(self, intensity, shift=None, k=5, max_candidates=50, min_overlap=2):
+        """
+        Same interface and result as SpectralLibrary.match, scored only over
+        the peak-overlap candidates.
+        """
+        query = (
+            resample(intensity, shift, self.grid) if shift is not None else intensity
+        )
+        ids = self.candidates(
+            peak_positions(query, self.grid), max_candidates, min_overlap
+        )
+        if not len(ids):
+            return []
+        reference = features(np.vstack([self.spectra[i] for i in ids]))
+        target = features(query)
+        scores = np.column_stack([r @ t[0] for r, t in zip(reference, target)])
+        ranking = scores.mean(axis=1)
+        top = np.argsort(-ranking)[:k]
+        return [
+            Match(self.names[ids[i]], float(ranking[i]), *map(float, scores[i]))
+            for i in top
+        ]
+
+    @classmethod
+    def from_library(cls, library):
+        index = cls(library.grid)
+        for name, spectrum in zip(library.names, library.spectra):
+            index.add(name, spectrum)
+        return index
+
+    @classmethod
+    def from_store(cls, store, index=None):
+        """
+        Indexes the records of a SpectrumStore, or appends them to `index`.
+        """
+        index = cls() if index is None else index
+        for i in range(len(store)):
+            record = store.read(i)
+            shift = record_shift(record)
+            if shift is None:
+                continue
+            name = record.metadata.get("name", f"{store.path.name}[{i}]")
+            index.add_measured(name, record.intensity, shift)
+        return index
+
+    def save(self, path):
+        counts = np.array([len(p) for p in self.peaks], dtype=np.int64)
+        np.savez(
+            path,
+            names=np.array(self.names, dtype=str),
+            spectra=np.array(self.spectra, dtype=np.float32).reshape(
+                -1, len(self.grid)
+            ),
+            peaks=np.concatenate(self.peaks) if self.peaks else np.empty(0),
+            peak_starts=np.concatenate([[0], np.cumsum(counts)]),
+            grid=self.grid,
+            bin_width=self.bin_width,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(data["grid"], float(data["bin_width"]))
+            starts = data["peak_starts"]
+            for i, name in enumerate(data["names"]):
+                peaks = data["peaks"][starts[i] : starts[i + 1]]
+                index.add(str(name), data["spectra"][i], peaks)
+        return index
+
+
+def synthetic_library(n, rng, peaks_per_spectrum=8):
+    """
+    Random Lorentzian line spectra on the grid, for benchmarking.
+    """
+    centers = rng.uniform(grid[0] + 50, grid[-1] - 50, (n, peaks_per_spectrum, 1))
+    heights = rng.uniform(0.2, 1.0, (n, peaks_per_spectrum, 1))
+    lines = heights / (1 + ((grid - centers) / 6.0) ** 2)
+    return lines.sum(axis=1).astype(np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak fingerprint index")
+    parser.add_argument("--store", help="spectrum store to index")
+    parser.add_argument("--dirs", nargs="*", help="CSV directories to index")
+    parser.add_argument("--output", default="fingerprints.npz")
+    parser.add_argument("--bench", type=int, metavar="N", help="time N references")
+    args = parser.parse_args()
+
+    if args.bench:
+        from similarity import SpectralLibrary
+
+        rng = np.random.default_rng(0)
+        spectra = synthetic_library(args.bench, rng)
+        t0 = time.perf_counter()
+        library = SpectralLibrary([str(i) for i in range(args.bench)], spectra)
+        index = FingerprintIndex.from_library(library)
+        print(f"Indexed {args.bench} spectra in {time.perf_counter() - t0:.1f} s")
+
+        queries = spectra[:100] + rng.normal(0, 0.02, (100, len(grid)))
+        for label, search in (("brute force", library), ("fingerprint", index)):
+            t0 = time.perf_counter()
+            hits = sum(
+                search.match(q, k=1)[0].name == str(i) for i, q in enumerate(queries)
+            )
+            per_query = (time.perf_counter() - t0) * 10
+            print(f"{label}: {per_query:.2f} ms per query, top-1 {hits}/100")
+    else:
+        from spectrum_store import SpectrumStore
+        from similarity import SpectralLibrary
+
+        index = FingerprintIndex()
+        if args.dirs:
+            index = FingerprintIndex.from_library(SpectralLibrary.from_dirs(args.dirs))
+        if args.store:
+            with SpectrumStore(args.store) as store:
+                FingerprintIndex.from_store(store, index)
+        index.save(args.output)
+        print(f"Indexed {len(index)} spectra, {len(index.bins)} bins -> {args.output}")
@@ -1,16 +1,26 @@
 import time
 
-import matplotlib.pyplot as plt
 import numpy as np
 import serial
-from scipy.optimize import curve_fit
+
+from averaging import RunningStats, average_until, band_mask
+from core import process_ch341_frame
+from liveplot import LivePlot
+from peakfit import GAUSSIAN, fast_fwhm, fit_peaks, model
+from tcd1304 import read_ch341_frame
 
 # Constants
 length = 3648  # Number of pixels
 bytes_expected = length * 2  # 2 bytes per pixel (12-bit data in 16-bit container)
-averages = 1
+averages = 1  # frames per spectrum when neither target_snr nor time_budget is set
+max_frames = 64  # cap on the frames averaged for target_snr or time_budget
+target_snr = None  # stop averaging early once this SNR is reached in snr_band
+snr_band = None  # (first, last) pixel for the SNR, None for the whole frame
+time_budget = None  # seconds per averaged spectrum
+full_fit_every = 10  # Gaussian fit every Nth frame (0: only on Enter)
 baudrate: int = 921600
 timeout: float = 1
+rx_buffer = bytearray(bytes_expected)  # reused for every frame
 
 """
 # Raman
@@ -24,66 +34,38 @@ raman_wavenumbers = (10000000 / wavelengths) - laser_wavenumber
 """
 
 
-def gaussian(x, a, mu, sigma):
-    return a * np.exp(-((x - mu) ** 2) / (2 * sigma**2))
-
-
-def find_fwhm(x, y):
-    try:
-        # Initial parameter estimates
-        a0 = np.max(y)
-        mu0 = x[np.argmax(y)]
-        sigma0 = max(8, (x[-1] - x[0]) / 10)  # Prevent too small initial sigma
-
-        # Set bounds to prevent unrealistic fits
-        bounds = (
-            [a0 * 0.5, x[0], 2],  # Lower bounds
-            [a0 * 1.5, x[-1], (x[-1] - x[0])],  # Upper bounds
-        )
-
-        # Fit Gaussian with bounds
-        popt, _ = curve_fit(gaussian, x, y, p0=[a0, mu0, sigma0], bounds=bounds)
-
-        # Calculate FWHM = 2.355 * sigma
-        fwhm = 2.355 * abs(popt[2])
-
-        return fwhm if fwhm > 2 else None, popt
-
-    except Exception:
-        return None, None
+def find_fwhm(x, y, sigma=None):
+    """
+    Gaussian fit of one window. Returns (fwhm, params), with fwhm None when
+    the fit did not converge; params are peakfit's amplitude, center, fwhm
+    and offset.
+    """
+    if len(x) < 5:
+        return None, None  # window clipped at the sensor edge
+    fit = fit_peaks(x, y, GAUSSIAN, sigma=sigma)
+    fwhm = fit.fwhm[0]
+    return (fwhm if fit.converged[0] and fwhm > 2 else None), fit.params[0]
 
 
 def read_sensor_data_12bpp(ser):
     """
-    Reads 12-bit data (packed in 16-bit words) from the TCD1304 sensor.
+    Reads 12-bit data (packed in 16-bit words) from the TCD1304 sensor;
+    None if the frame was incomplete.
     """
-    ser.reset_input_buffer()
-
     packet = bytearray()
     packet.append(0xA1)  # read TCD1304 module (12 bpp, 7296 bytes)
     # packet.append(0xA2)  # read TCD1304 module (8 bpp, 3648 bytes)
     packet.append(0xB8)  # set integration time (Max D7, min B0)
-    ser.write(packet)  # Request data
-
-    buffer = bytearray()
-    start_time = time.time()
-    timeout_duration = 5
 
-    while len(buffer) < bytes_expected:
-        if time.time() - start_time > timeout_duration:
-            print(
-                f"Timeout reached. Received {len(buffer)} bytes out of {bytes_expected}."
-            )
-            break
-        if ser.in_waiting > 0:
-            buffer += ser.read(ser.in_waiting)
+    status = read_ch341_frame(ser, packet, rx_buffer, timeout=5)
 
-    if len(buffer) < bytes_expected:
-        print("Warning: Incomplete data received.")
-        return np.zeros(length, dtype=np.uint16)
+    if not status.complete:
+        print(f"Timeout reached. {status}.")
+        print("Warning: Incomplete data received, frame skipped.")
+        return None
 
     # Interpret as 16-bit words, assuming little-endian format
-    raw_data = np.frombuffer(buffer[:bytes_expected], dtype=np.uint16)
+    raw_data = np.frombuffer(rx_buffer, dtype=np.uint16)
 
     # Mask to 12-bit data
     pixel_data = raw_data & 0x0FFF
@@ -91,55 +73,68 @@ def read_sensor_data_12bpp(ser):
     return pixel_data
 
 
-def update_plot_12bpp(sensor_data, line, ax):
+def update_plot_12bpp(sensor_data, plot, stderr=None, full_fit=True):
     """
     Updates the live plot with new 12-bit intensity values from the sensor.
+    The closed-form line width is printed for every frame; the Gaussian fit,
+    weighted by `stderr` (standard error per pixel) when given, only runs
+    when `full_fit` is set. On other frames the last fit is drawn faded.
     """
     if len(sensor_data) != length:
         print(
             f"Warning: Expected {length} pixels, got {len(sensor_data)}. Plotting available data."
         )
 
-    sensor_data = 4095 - sensor_data
-    sensor_data[0:4] = sensor_data[5]
+    sensor_data = process_ch341_frame(sensor_data)
 
     # Calculate and print FWHM
     pixels = np.arange(length)
+    t0 = time.perf_counter()
+    width = fast_fwhm(sensor_data)
+    fast_time = time.perf_counter() - t0
     maxima_index = np.argmax(sensor_data)
     start_index = max(0, int(maxima_index - 10))
     end_index = min(length, int(maxima_index + 10))
-
-    fwhm, popt = find_fwhm(
-        pixels[start_index:end_index], sensor_data[start_index:end_index]
+    report = (
+        f"FWHM: {width.fwhm:.2f} px log-parabola, {width.halfmax_fwhm:.2f} px "
+        f"half-max ({fast_time * 1e6:.0f} us)"
     )
 
-    if fwhm is not None:
-        print(f"FWHM: {fwhm:.2f} pixels")
-
-        # Plot data and fit
-        line.set_data(pixels, sensor_data)
+    fwhm = None
+    if full_fit:
+        sigma = None
+        if stderr is not None and np.all(np.isfinite(stderr[start_index:end_index])):
+            sigma = np.maximum(stderr[start_index:end_index], 1e-6)
+        t0 = time.perf_counter()
+        fwhm, popt = find_fwhm(
+            pixels[start_index:end_index], sensor_data[start_index:end_index], sigma
+        )
+        fit_time = time.perf_counter() - t0
+        fitted = "fit failed" if fwhm is None else f"{fwhm:.2f} px fit"
+        report += f", {fitted} ({fit_time * 1e3:.2f} ms)"
+    print(report)
 
+    plot.set_data(sensor_data)
+    fit_line = plot.lines[1]
+    if fwhm is not None:
         # Plot gaussian fit
         x_fit = pixels[start_index:end_index]
-        y_fit = gaussian(x_fit, *popt)
-        if not hasattr(ax, "fit_line"):
-            (ax.fit_line,) = ax.plot(x_fit, y_fit, "r--", label="Gaussian fit")
-        else:
-            ax.fit_line.set_data(x_fit, y_fit)
-
-        # Zoom to fit region
-        ax.set_xlim(start_index - 10, end_index + 10)
-        ax.set_ylim(
-            min(sensor_data[start_index:end_index]) * 0.9,
-            max(sensor_data[start_index:end_index]) * 1.1,
-        )
+        plot.set_data(model(x_fit, popt)[0], line=1, x=x_fit)
+        fit_line.set_alpha(1.0)
+    elif full_fit:
+        # A failed fit clears the previous one
+        plot.set_data([np.nan], line=1, x=[np.nan])
     else:
-        line.set_ydata(sensor_data)
-        ax.set_xlim(0, length)
-        ax.set_ylim(0, 4095)
+        # No refit on this frame: the fit shown is from an earlier frame
+        fit_line.set_alpha(0.3)
 
-    plt.draw()
-    plt.pause(0.01)
+    # Zoom to the fit region; y follows the data in view. The background is
+    # only redrawn when the peak moves.
+    if np.isfinite(width.fwhm):
+        plot.set_limits(xlim=(start_index - 10, end_index + 10))
+    else:
+        plot.set_limits(xlim=(0, length))
+    plot.render()
 
 
 if __name__ == "__main__":
@@ -147,26 +142,51 @@ if __name__ == "__main__":
     ser = serial.Serial(port_name, baudrate, timeout=timeout)
     print(f"Connected to {port_name}")
 
-    # Set up the live plot
-    plt.ion()
-    fig, ax = plt.subplots(figsize=(10, 6))
+    # Set up the live plot: the spectrum and the Gaussian fit
     pixels = np.arange(length)
-    (line,) = ax.plot(pixels, np.zeros(length))
-    ax.set_title("TCD1304 Spectrum (12-bit mode) - Live Update")
-    ax.set_xlabel("Pixel")
-    ax.set_ylabel("Intensity (12-bit)")
-    ax.set_ylim(0, 4095)
-    ax.grid(True)
-    plt.show()
+    plot = LivePlot(
+        pixels,
+        styles=("-", "r--"),
+        title="TCD1304 Spectrum (12-bit mode) - Live Update",
+        xlabel="Pixel",
+        ylabel="Intensity (12-bit)",
+        ylim=(0, 4095),
+    )
+
+    # Press Enter in the plot window to run the full fit on the next frame
+    fit_requested = False
+
+    def request_fit(event):
+        global fit_requested
+        if event.key == "enter":
+            fit_requested = True
 
+    plot.fig.canvas.mpl_connect("key_press_event", request_fit)
+
+    stats = RunningStats(length)
+    # averages only applies to fixed averaging; an SNR or time target
+    # averages up to max_frames
+    adaptive = target_snr is not None or time_budget is not None
+    band = None if snr_band is None else band_mask(pixels, *snr_band)
+    frame = 0
     while True:
         try:
-            data = np.zeros(length, dtype=np.float64)
-            for i in range(averages):
-                data += read_sensor_data_12bpp(ser)
-                time.sleep(0.2)
-            data /= averages
-            update_plot_12bpp(data, line, ax)
+            data, stderr, n = average_until(
+                lambda: read_sensor_data_12bpp(ser),
+                length,
+                max_frames=max_frames if adaptive else averages,
+                target_snr=target_snr,
+                band=band,
+                time_budget=time_budget,
+                reference=4095,
+                stats=stats,
+            )
+            full_fit = fit_requested or (
+                full_fit_every > 0 and frame % full_fit_every == 0
+            )
+            fit_requested = False
+            update_plot_12bpp(data, plot, stderr, full_fit)
+            frame += 1
         except serial.SerialException as e:
             print(f"Serial port error: {e}")
         except Exception as e:
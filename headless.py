@@ -0,0 +1,320 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from acquisition import AcquisitionThread, FrameRing
+from core import (
+    TimingError,
+    check_timing,
+    er_periods,
+    gaussian_mag,
+    process_ch341_frame,
+    process_er_frame,
+    smooth,
+)
+from tcd1304 import ShortReadError, ch341_length, length
+
+# Modules a headless run must not load
+gui_modules = ("matplotlib", "tkinter", "PyQt5", "PyQt6")
+
+# Serial port and read timeout (s) per board; the ER timeout follows ICG
+default_ports = {"er": "/dev/ttyACM0", "ch341": "/dev/ttyCH341USB0"}
+ch341_timeout = 5
+
+
+class Throughput:
+    """
+    Frame counts and per-stage processing time, reported per interval and
+    for the whole run.
+    """
+
+    stages = ("process", "peaks", "store")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.processed = 0
+        self.stored = 0
+        self.bytes = 0
+        self.times = dict.fromkeys(self.stages, 0.0)
+        self._mark = (self.start, 0, 0, dict(self.times))
+
+    def add(self, stage, seconds):
+        self.times[stage] += seconds
+
+    def report(self, acquisition, ring, tracker=None):
+        now = time.perf_counter()
+        last, processed, acquired, times = self._mark
+        elapsed = max(now - last, 1e-9)
+        frames = max(self.processed - processed, 1)
+        per_stage = ", ".join(
+            f"{stage} {(self.times[stage] - times[stage]) / frames * 1e3:.2f}"
+            for stage in self.stages
+        )
+        line = (
+            f"[{now - self.start:7.1f} s] acquired {acquisition.frames} "
+            f"({(acquisition.frames - acquired) / elapsed:.1f} fps), processed "
+            f"{self.processed}, stored {self.stored} ({self.bytes / 1e6:.1f} MB), "
+            f"dropped {ring.dropped}, errors {acquisition.errors}; "
+            f"ms/frame: {per_stage}"
+        )
+        if tracker is not None:
+            line += f"; {len(tracker.peaks())} peaks"
+        self._mark = (now, self.processed, acquisition.frames, dict(self.times))
+        return line
+
+
+def er_source(args):
+    """
+    ER board: SH/ICG/averages are sent with every request.
+    """
+    from calibration import load_calibration
+    from tcd1304 import SensorSession
+
+    SHperiod, ICGperiod = er_periods(args.sh, args.icg)
+    check_timing(SHperiod, ICGperiod)
+    session = SensorSession(
+        args.port, args.baud, SHperiod, ICGperiod, args.averages, args.timeout
+    )
+    calibration = load_calibration("er", args.calibration_session)
+    metadata = {
+        "sensor": "er",
+        "SH": args.sh,
+        "ICG": args.icg,
+        "averages": args.averages,
+        "balanced": args.balanced,
+        "laser_nm": calibration.laser_nm,
+        "calibration": calibration.coefficients,
+        "calibration_session": args.calibration_session,
+    }
+
+    def process(frame):
+        return process_er_frame(frame, args.balanced)
+
+    return session.acquire, process, length, np.uint16, session.close, metadata
+
+
+def ch341_source(args):
+    """
+    CH341 board, 12 bpp, with the integration code sent after 0xA1.
+    """
+    import serial
+
+    timeout = args.timeout or ch341_timeout
+    ser = serial.Serial(args.port, args.baud, timeout=timeout)
+    packet = bytes([0xA1, args.integration])
+    buffer = bytearray(2 * ch341_length)
+
+    def read_frame():
+        from tcd1304 import read_ch341_frame
+
+        status = read_ch341_frame(ser, packet, buffer, timeout)
+        if not status.complete:
+            raise ShortReadError(status.received, status.expected)
+        return np.frombuffer(buffer, dtype="<u2") & 0x0FFF
+
+    metadata = {"sensor": "ch341", "integration": args.integration}
+    return read_frame, process_ch341_frame, ch341_length, np.uint16, ser.close, metadata
+
+
+def webcam_source(args):
+    """
+    Webcam: ROI spectra from raw YUYV frames (see webcam.py).
+    """
+    from calibration import load_calibration
+    from webcam import RoiReducer, height, open_camera, roi_rows
+
+    cap = open_camera(args.camera, args.width, height)
+    rows = roi_rows(height)
+    reducer = RoiReducer(rows, args.width)
+
+    def read_frame():
+        ok, frame = cap.read()
+        if not ok:
+            raise IOError("Camera read failed")
+        return reducer(frame)
+
+    calibration = load_calibration("webcam").for_pixels(args.width)
+    metadata = {
+        "sensor": "webcam",
+        "laser_nm": calibration.laser_nm,
+        "calibration": calibration.coefficients,
+        "rows": list(rows),
+        "pixel_format": "YUYV",
+    }
+    return read_frame, np.asarray, args.width, np.float32, cap.release, metadata
+
+
+sources = {"er": er_source, "ch341": ch341_source, "webcam": webcam_source}
+
+
+def run(args):
+    """
+    Acquires on a background thread and processes every frame: board
+    specific conversion, dark subtraction, smoothing and peak tracking.
+    Every `save_every`-th spectrum is appended to the store together with
+    its tracked peaks. Returns the Throughput counters.
+    """
+    from darkframes import dark_frames
+    from spectrum_store import open_store
+    from tracker import PeakTracker, frame_noise, smoothed_noise
+
+    read_frame, process, n_pixels, dtype, close, metadata = sources[args.sensor](args)
+    metadata.update(dark_frame=args.dark, smoothing=args.smooth)
+    store = open_store(args.store) if args.store else None
+    # Smoothing widens every line by ~2.4 sigma, so the refinement window
+    # (and the widths it accepts) grow with it
+    gate = max(6, int(np.ceil(2 * args.smooth)))
+    tracker = PeakTracker(gate=gate, baseline_window=4 * gate) if args.peaks else None
+    clock_offset = time.time() - time.perf_counter()
+
+    # Load scipy (smoothing, peak search) before frames start arriving
+    PeakTracker().update(smooth(np.random.default_rng(0).random(n_pixels)))
+
+    ring = FrameRing(args.buffer, n_pixels, dtype)
+    acquisition = AcquisitionThread(read_frame, ring)
+    stats = Throughput()
+    acquisition.start()
+    last_report = stats.start
+    try:
+        while True:
+            elapsed = time.perf_counter() - stats.start
+            if args.frames and stats.processed >= args.frames:
+                break
+            if args.duration and elapsed >= args.duration:
+                break
+            if time.perf_counter() - last_report >= args.report:
+                last_report = time.perf_counter()
+                print(stats.report(acquisition, ring, tracker), flush=True)
+                if acquisition.last_error:
+                    print(f"Acquisition error: {acquisition.last_error}")
+                    acquisition.last_error = None
+
+            frames, timestamps = ring.drain()
+            if not len(frames):
+                time.sleep(0.001)
+                continue
+            for frame, timestamp in zip(frames, timestamps):
+                t0 = time.perf_counter()
+                spectrum = process(frame).astype(np.float64)
+                if args.dark:
+                    dark_frames.subtract(
+                        spectrum,
+                        args.dark,
+                        args.sensor,
+                        metadata.get("SH"),
+                        metadata.get("ICG"),
+                        metadata.get("averages"),
+                    )
+                noise = None
+                if tracker is not None and tracker.frames % tracker.redetect_every == 0:
+                    # Measured before smoothing, which hides the noise
+                    noise = smoothed_noise(frame_noise(spectrum), args.smooth)
+                spectrum = smooth(spectrum, args.smooth)
+                t1 = time.perf_counter()
+                if tracker is not None:
+                    tracker.update(spectrum, clock_offset + timestamp, noise)
+                t2 = time.perf_counter()
+                if store is not None and stats.processed % args.save_every == 0:
+                    record = dict(metadata)
+                    if tracker is not None:
+                        record["peaks"] = [
+                            [peak.id, peak.position, peak.height, peak.width]
+                            for peak in tracker.peaks()
+                        ]
+                    size = store.size()
+                    store.append(spectrum, record, clock_offset + timestamp)
+                    stats.bytes += store.size() - size
+                    stats.stored += 1
+                t3 = time.perf_counter()
+                stats.add("process", t1 - t0)
+                stats.add("peaks", t2 - t1)
+                stats.add("store", t3 - t2)
+                stats.processed += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        acquisition.stop(timeout=2)
+        close()
+    print(stats.report(acquisition, ring, tracker))
+    if tracker is not None:
+        print(tracker.table())
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Headless acquisition: process spectra and stream them to a "
+        "spectrum store without any plotting"
+    )
+    parser.add_argument("--sensor", choices=sorted(sources), default="er")
+    parser.add_argument(
+        "--port", default=None, help="default: " + ", ".join(default_ports.values())
+    )
+    parser.add_argument("--baud", type=int, default=None)
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="serial read timeout in seconds "
+        "(default: ICG x averages plus a margin for er, 5 s for ch341)",
+    )
+    parser.add_argument("--sh", type=float, default=10, help="SH in microseconds")
+    parser.add_argument("--icg", type=float, default=10000, help="ICG in microseconds")
+    parser.add_argument("--averages", type=int, default=1)
+    parser.add_argument("--balanced", action="store_true")
+    parser.add_argument("--calibration-session", default=None)
+    parser.add_argument(
+        "--integration",
+        type=lambda code: int(code, 0),
+        default=0xB8,
+        help="CH341 integration code, 0xB0-0xD7",
+    )
+    parser.add_argument("--camera", type=int, default=0)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--dark", default=None, help="dark frame CSV or model")
+    parser.add_argument("--smooth", type=float, default=gaussian_mag, help="sigma")
+    parser.add_argument("--no-peaks", dest="peaks", action="store_false")
+    parser.add_argument("--store", default="spectra.spec", help="'' to not save")
+    parser.add_argument("--save-every", type=int, default=1)
+    parser.add_argument("--frames", type=int, default=0, help="stop after N")
+    parser.add_argument("--duration", type=float, default=0, help="stop after s")
+    parser.add_argument("--report", type=float, default=10, help="stats every s")
+    parser.add_argument("--buffer", type=int, default=64, help="frames buffered")
+    parser.add_argument(
+        "--simulate", action="store_true", help="acquire from simulator.py"
+    )
+    args = parser.parse_args()
+    if args.simulate and args.sensor == "webcam":
+        parser.error("--simulate supports the er and ch341 sensors only")
+    if args.baud is None:
+        args.baud = 921600 if args.sensor == "ch341" else 115200
+    if args.port is None and args.sensor in default_ports:
+        args.port = default_ports[args.sensor]
+    if args.sensor == "er" and args.timeout is not None:
+        from tcd1304 import integration_time
+
+        needed = integration_time(er_periods(args.sh, args.icg)[1], args.averages)
+        if args.timeout <= needed:
+            parser.error(
+                f"--timeout {args.timeout} s is shorter than the integration "
+                f"time of {needed:.2f} s (ICG x averages)"
+            )
+
+    simulator = None
+    if args.simulate:
+        from simulator import SensorSimulator
+
+        simulator = SensorSimulator(args.sensor, seed=0)
+        args.port = simulator.start()
+    try:
+        run(args)
+    except TimingError as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        if simulator is not None:
+            simulator.stop()
+    loaded = [name for name in gui_modules if name in sys.modules]
+    print("GUI modules loaded: " + (", ".join(loaded) if loaded else "none"))
@@ -0,0 +1,216 @@
+import argparse
+import time
+from collections import deque
+
+import numpy as np
+
+
+class LivePlot:
+    """
+    Live line plot redrawn by blitting. The figure, axes and line artists
+    are built once; the static parts (axes, ticks, labels, grid) are
+    rendered into a cached background and each frame only restores it and
+    redraws the lines. A full redraw happens only when the limits change:
+    on `set_limits`, or when `autoscale` finds the data outside the y
+    range or using less than a third of it.
+
+    `update` can be called on every acquired frame; it renders at most
+    every `interval` seconds, so the plot keeps its own cadence. The
+    achieved rate is in `fps` and shown in the corner of the axes.
+    """
+
+    def __init__(
+        self,
+        x,
+        styles=("-",),
+        labels=None,
+        title=None,
+        xlabel=None,
+        ylabel=None,
+        xlim=None,
+        ylim=None,
+        autoscale=True,
+        margin=0.1,
+        interval=1 / 30,
+        figsize=(10, 6),
+    ):
+        import matplotlib.pyplot as plt
+
+        plt.ion()
+        self.fig, self.ax = plt.subplots(figsize=figsize)
+        self.x = np.asarray(x)
+        self.lines = [
+            self.ax.plot(
+                self.x,
+                np.full(len(self.x), np.nan),
+                style,
+                animated=True,
+                label=None if labels is None else labels[i],
+            )[0]
+            for i, style in enumerate(styles)
+        ]
+        self.fps_text = self.ax.text(
+            0.99, 0.98, "", transform=self.ax.transAxes, ha="right", va="top"
+        )
+        self.fps_text.set_animated(True)
+        self.artists = [*self.lines, self.fps_text]
+
+        if title:
+            self.ax.set_title(title)
+        if xlabel:
+            self.ax.set_xlabel(xlabel)
+        if ylabel:
+            self.ax.set_ylabel(ylabel)
+        if labels is not None:
+            self.ax.legend(loc="upper left")
+        self.ax.grid(True)
+        self.ax.set_xlim(*(xlim or (np.min(self.x), np.max(self.x))))
+        if ylim:
+            self.ax.set_ylim(*ylim)
+
+        self.autoscale = autoscale
+        self.margin = margin
+        self.interval = interval
+        self.frames = 0
+        self._times = deque(maxlen=30)
+        self._last = 0.0
+        self._background = None
+        self._redraw = True
+        self._stale = False
+        self.fig.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _on_draw(self, event):
+        # Any full draw (ours, a resize, a zoom) refreshes the background
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+
+    def set_data(self, y, line=0, x=None):
+        """
+        New data for one line, drawn on the next render.
+        """
+        self.lines[line].set_data(self.x if x is None else x, y)
+        self._stale = True
+
+    def set_limits(self, xlim=None, ylim=None):
+        """
+        Axis limits; the background is only redrawn if they change.
+        """
+        for limits, current, setter in (
+            (xlim, self.ax.get_xlim(), self.ax.set_xlim),
+            (ylim, self.ax.get_ylim(), self.ax.set_ylim),
+        ):
+            if limits is not None and not np.allclose(limits, current):
+                setter(*limits)
+                self._redraw = True
+
+    def _autoscale(self):
+        low, high = self.ax.get_xlim()
+        values = []
+        for line in self.lines:
+            x, y = (np.asarray(data, dtype=np.float64) for data in line.get_data())
+            y = y[(x >= min(low, high)) & (x <= max(low, high))]
+            values.append(y[np.isfinite(y)])
+        values = np.concatenate(values)
+        if not len(values):
+            return
+        top, bottom = values.max(), values.min()
+        span = max(top - bottom, 1e-9)
+        current = self.ax.get_ylim()
+        outside = bottom < current[0] or top > current[1]
+        loose = current[1] - current[0] > 3 * (1 + 2 * self.margin) * span
+        if outside or loose:
+            self.set_limits(
+                ylim=(bottom - self.margin * span, top + self.margin * span)
+            )
+
+    def render(self, force=False):
+        """
+        Draws new data unless the last render was less than `interval` ago.
+        Returns whether it drew.
+        """
+        now = time.perf_counter()
+        if not force and (
+            not (self._stale or self._redraw) or now - self._last < self.interval
+        ):
+            return False
+        self._last = now
+        self._stale = False
+        self._times.append(now)
+        self.frames += 1
+        self.fps_text.set_text(f"{self.fps:.0f} fps")
+
+        if self.autoscale:
+            self._autoscale()
+        canvas = self.fig.canvas
+        if self._redraw or self._background is None:
+            self._redraw = False
+            canvas.draw()  # static parts, cached by _on_draw
+        else:
+            canvas.restore_region(self._background)
+            for artist in self.artists:
+                self.fig.draw_artist(artist)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+        return True
+
+    def update(self, y, line=0, x=None, force=False):
+        self.set_data(y, line, x)
+        return self.render(force)
+
+    def pause(self, seconds):
+        """
+        Keeps the window responsive while waiting, without redrawing.
+        """
+        self.fig.canvas.start_event_loop(seconds)
+
+    def close(self):
+        import matplotlib.pyplot as plt
+
+        plt.close(self.fig)
+
+    @property
+    def fps(self):
+        if len(self._times) < 2:
+            return 0.0
+        return (len(self._times) - 1) / (self._times[-1] - self._times[0])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live plot benchmark")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--length", type=int, default=3694)
+    args = parser.parse_args()
+
+    import matplotlib.pyplot as plt
+
+    rng = np.random.default_rng(0)
+    x = np.arange(args.length)
+    peak = 2000 * np.exp(-(((x - args.length / 2) / 20) ** 2))
+    frames = [peak + rng.normal(0, 20, args.length) for _ in range(args.frames)]
+
+    # What the front ends did: clear and rebuild the figure every frame
+    fig = plt.figure(figsize=(10, 6))
+    t0 = time.perf_counter()
+    for frame in frames:
+        plt.clf()
+        plt.plot(x, frame)
+        plt.grid(True)
+        plt.xlabel("Pixel")
+        fig.canvas.draw()
+        fig.canvas.flush_events()
+    rebuild = (time.perf_counter() - t0) / args.frames
+    plt.close(fig)
+
+    plot = LivePlot(x, xlabel="Pixel", interval=0)
+    t0 = time.perf_counter()
+    for frame in frames:
+        plot.update(frame)
+    blit = (time.perf_counter() - t0) / args.frames
+
+    print(f"{args.length} points per frame ({plt.get_backend()}):")
+    print(f"  clf and redraw: {rebuild * 1e3:6.1f} ms ({1 / rebuild:5.0f} fps)")
+    print(
+        f"  blitting:       {blit * 1e3:6.1f} ms ({plot.fps:5.0f} fps), "
+        f"{plot.frames} frames"
+    )
@@ -0,0 +1,267 @@
+import hashlib
+import time
+import warnings
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+cache_dir = Path(__file__).resolve().parent / ".cache" / "spectra"
+cache_version = 3
+
+# Known layouts, sniffed from the first line of each file
+WEBCAM = "webcam"  # Wavelength,Wavenumber,Intensity with 1920 rows
+ER = "er"  # bare intensity column, 3694 rows (ER board)
+CH341 = "ch341"  # bare intensity column, 3648 rows (CH341 board)
+REFERENCE = "reference"  # headerless x/y pairs, tab or comma separated
+
+# Axis unit of each layout; files in another unit form their own set
+native_units = {WEBCAM: "nm", ER: "nm", CH341: "pixel", REFERENCE: "cm-1"}
+
+# Headerless axes within this range (nm) are taken as wavelengths, such as
+# the lamp and filter spectra in Archive; Raman references reach past it
+wavelength_range = (190.0, 1300.0)
+
+
+class SpectrumSet(NamedTuple):
+    names: list
+    axis: np.ndarray
+    unit: str  # "nm", "cm-1", "pixel" or "unknown"
+    intensities: np.ndarray  # (n_spectra, n_pixels)
+    schema: str  # layout of the files, e.g. "reference" for "reference-nm"
+
+
+def sniff(path):
+    """
+    Returns (schema, delimiter, header) for a spectrum CSV.
+    """
+    with open(path) as f:
+        first = f.readline().strip()
+    delimiter = "\t" if "\t" in first else ","
+    columns = [c.strip().lower() for c in first.split(delimiter)]
+    if columns[:1] == ["wavelength"]:
+        return WEBCAM, delimiter, columns
+    if columns == ["intensity"]:
+        with open(path, "rb") as f:
+            rows = sum(1 for line in f if line.strip()) - 1
+        return (ER if rows == 3694 else CH341), delimiter, columns
+    float(columns[0])  # headerless data must start with a number
+    return REFERENCE, delimiter, None
+
+
+def er_wavelengths():
+    from calibration import load_calibration
+
+    return load_calibration("er").wavelengths
+
+
+def read_spectrum(path):
+    """
+    Reads any known layout. Returns (schema, axis, unit, intensity).
+    """
+    schema, delimiter, header = sniff(path)
+    skip = 0 if header is None else 1
+    data = np.loadtxt(path, delimiter=delimiter, skiprows=skip, ndmin=2)
+    if schema == WEBCAM:
+        return schema, data[:, 0], "nm", data[:, header.index("intensity")]
+    if schema == ER:
+        return schema, er_wavelengths(), "nm", data[:, 0]
+    if schema == CH341:
+        return schema, np.arange(len(data), dtype=np.float64), "pixel", data[:, 0]
+    return schema, data[:, 0], reference_unit(data[:, 0]), data[:, 1]
+
+
+def reference_unit(axis):
+    """
+    Unit of a headerless x column, from its range: "nm" inside
+    `wavelength_range`, "cm-1" for Raman shifts past it, else "unknown".
+    """
+    low, high = np.min(axis), np.max(axis)
+    if wavelength_range[0] <= low and high <= wavelength_range[1]:
+        return "nm"
+    if high > wavelength_range[1] and low > -500:
+        return "cm-1"
+    return "unknown"
+
+
+def set_name(schema, unit):
+    """
+    Key of the SpectrumSet holding files of `schema` with axes in `unit`:
+    the schema itself in its native unit, else "<schema>-<unit>".
+    """
+    return schema if native_units.get(schema) == unit else f"{schema}-{unit}"
+
+
+def _stack(entries):
+    """
+    Stacks (name, schema, axis, unit, intensity) entries into one SpectrumSet
+    per schema and unit (see set_name). Spectra whose axis differs from the
+    first one of their set (in file name order) are interpolated onto it,
+    with NaN where they do not cover it; a spectrum not overlapping it at
+    all is skipped with a warning naming the file.
+    """
+    groups = {}
+    for name, schema, axis, unit, intensity in entries:
+        key = set_name(schema, unit)
+        group = groups.setdefault(key, ([], axis, unit, [], schema))
+        if len(axis) != len(group[1]) or not np.allclose(axis, group[1]):
+            overlap = min(axis.max(), group[1].max()) - max(axis.min(), group[1].min())
+            if overlap <= 0:
+                warnings.warn(
+                    f"Skipping {name}: its axis ({axis.min():g}-{axis.max():g} "
+                    f"{unit}) does not overlap the {key} set's "
+                    f"({group[1].min():g}-{group[1].max():g} {unit})"
+                )
+                continue
+            order = np.argsort(axis)
+            intensity = np.interp(
+                group[1], axis[order], intensity[order], left=np.nan, right=np.nan
+            )
+        group[0].append(name)
+        group[3].append(intensity)
+    return {
+        key: SpectrumSet(names, axis, unit, np.vstack(rows), schema)
+        for key, (names, axis, unit, rows, schema) in groups.items()
+    }
+
+
+def _cache_path(directory):
+    digest = hashlib.sha1(str(Path(directory).resolve()).encode()).hexdigest()[:8]
+    return cache_dir / f"{Path(directory).resolve().name}-{digest}.npz"
+
+
+def _read_cache(path):
+    try:
+        with np.load(path) as cache:
+            if int(cache["version"]) != cache_version:
+                return None
+            files = dict(zip(cache["files"], zip(cache["mtimes"], cache["sizes"])))
+            sets = {}
+            for key in cache["schemas"]:
+                sets[str(key)] = SpectrumSet(
+                    [str(n) for n in cache[f"names:{key}"]],
+                    cache[f"axis:{key}"],
+                    str(cache[f"unit:{key}"]),
+                    cache[f"data:{key}"],
+                    str(cache[f"schema:{key}"]),
+                )
+            return files, sets
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _write_cache(path, stats, sets):
+    arrays = {
+        "version": np.array(cache_version),
+        "files": np.array(list(stats), dtype=str),
+        "mtimes": np.array([s[0] for s in stats.values()], dtype=np.int64),
+        "sizes": np.array([s[1] for s in stats.values()], dtype=np.int64),
+        "schemas": np.array(list(sets), dtype=str),
+    }
+    for key, spectra in sets.items():
+        arrays[f"names:{key}"] = np.array(spectra.names, dtype=str)
+        arrays[f"axis:{key}"] = spectra.axis
+        arrays[f"unit:{key}"] = np.array(spectra.unit)
+        arrays[f"data:{key}"] = spectra.intensities
+        arrays[f"schema:{key}"] = np.array(spectra.schema)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp.npz")
+    np.savez(tmp, **arrays)
+    tmp.replace(path)
+
+
+def load_dir(directory, pattern="*.csv", use_cache=True):
+    """
+    Loads every spectrum in `directory` into one SpectrumSet per schema and
+    unit, keyed by set_name.
+
+    The parsed arrays are kept in a binary cache under `cache_dir`. Files are
+    only parsed again when their mtime or size changed, so reopening an
+    unchanged directory is one np.load.
+    """
+    paths = sorted(p for p in Path(directory).glob(pattern) if p.is_file())
+    stats = {}
+    for path in paths:
+        stat = path.stat()
+        stats[path.name] = (stat.st_mtime_ns, stat.st_size)
+
+    cache_path = _cache_path(directory)
+    cached = _read_cache(cache_path) if use_cache else None
+    if cached and cached[0] == stats:
+        return cached[1]
+
+    # Reuse the rows of unchanged files and parse the rest
+    rows = {}
+    if cached:
+        cached_stats, cached_sets = cached
+        for spectra in cached_sets.values():
+            for name, intensity in zip(spectra.names, spectra.intensities):
+                if cached_stats.get(name) == stats.get(name):
+                    rows[name] = (spectra.axis, spectra.unit, intensity)
+        schemas = {n: sp.schema for sp in cached_sets.values() for n in sp.names}
+
+    entries = []
+    for path in paths:
+        if path.name in rows:
+            axis, unit, intensity = rows[path.name]
+            entries.append((path.name, schemas[path.name], axis, unit, intensity))
+            continue
+        try:
+            schema, axis, unit, intensity = read_spectrum(path)
+        except (OSError, ValueError, IndexError) as e:
+            # Left in the stats so the cache still validates; it is not in any set
+            warnings.warn(f"Skipping {path}: {e}")
+            continue
+        entries.append((path.name, schema, axis, unit, intensity))
+
+    sets = _stack(entries)
+    if use_cache:
+        _write_cache(cache_path, stats, sets)
+    return sets
+
+
+def load_files(paths, use_cache=True, skip=False):
+    """
+    Loads individual files through their directory caches.
+    Returns a list of (schema, axis, unit, intensity) in the order given.
+    With `skip`, a file that cannot be loaded is None in the list, with a
+    warning, instead of raising.
+    """
+    loaded = []
+    directories = {}
+    for path in map(Path, paths):
+        if path.parent not in directories:
+            directories[path.parent] = load_dir(path.parent, use_cache=use_cache)
+        for spectra in directories[path.parent].values():
+            if path.name in spectra.names:
+                row = spectra.names.index(path.name)
+                loaded.append(
+                    (
+                        spectra.schema,
+                        spectra.axis,
+                        spectra.unit,
+                        spectra.intensities[row],
+                    )
+                )
+                break
+        else:
+            if not skip:
+                raise ValueError(f"Could not load {path}")
+            warnings.warn(f"Skipping {path}: it could not be loaded")
+            loaded.append(None)
+    return loaded
+
+
+if __name__ == "__main__":
+    import sys
+
+    for directory in sys.argv[1:] or ["Data", "FilterData", "Concentrations"]:
+        t0 = time.perf_counter()
+        sets = load_dir(directory, use_cache=False)
+        parse = (time.perf_counter() - t0) * 1e3
+        load_dir(directory)  # refresh the cache
+        t0 = time.perf_counter()
+        load_dir(directory)
+        cached = (time.perf_counter() - t0) * 1e3
+        shapes = ", ".join(f"{s}: {v.intensities.shape}" for s, v in sets.items())
+        print(f"{directory}: parse {parse:.1f} ms, cached {cached:.1f} ms  [{shapes}]")
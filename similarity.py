@@ -0,0 +1,189 @@
+import argparse
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+# Common Raman shift grid (cm^-1) every spectrum is resampled onto
+grid = np.arange(200.0, 3400.0, 2.0)
+laser_nm = {"webcam": 532.0, "er": 632.8}  # per loader schema
+methods = ("cosine", "pearson", "derivative")
+
+
+class Match(NamedTuple):
+    name: str
+    score: float
+    cosine: float
+    pearson: float
+    derivative: float
+
+
+def raman_shift(axis, unit, laser):
+    """
+    Converts an axis in nm or cm^-1 to a Stokes Raman shift in cm^-1.
+    """
+    if unit == "cm-1":
+        return np.asarray(axis, dtype=np.float64)
+    return 1e7 / laser - 1e7 / np.asarray(axis, dtype=np.float64)
+
+
+def resample(intensity, shift, grid=grid):
+    """
+    Linear interpolation onto `grid`; points outside the measured range are 0.
+    """
+    order = np.argsort(shift)
+    return np.interp(grid, shift[order], intensity[order], left=0.0, right=0.0)
+
+
+def _normalize(rows):
+    norms = np.linalg.norm(rows, axis=-1, keepdims=True)
+    return rows / np.where(norms > 0, norms, 1)
+
+
+def features(spectra):
+    """
+    Unit-norm matrices for each method from (n, len(grid)) resampled spectra.
+    """
+    spectra = np.atleast_2d(spectra).astype(np.float32)
+    spectra = spectra - spectra.min(axis=1, keepdims=True)
+    cosine = _normalize(spectra)
+    pearson = _normalize(spectra - spectra.mean(axis=1, keepdims=True))
+    derivative = _normalize(np.diff(spectra, axis=1))
+    return cosine, pearson, derivative
+
+
+class SpectralLibrary:
+    """
+    Reference spectra on a common Raman shift grid. A query is scored against
+    every reference at once with one matrix-vector product per method.
+    """
+
+    def __init__(self, names, spectra, grid=grid):
+        self.names = list(names)
+        self.grid = np.asarray(grid)
+        self.spectra = np.asarray(spectra, dtype=np.float32).reshape(-1, len(grid))
+        self.cosine, self.pearson, self.derivative = features(self.spectra)
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_dirs(cls, directories):
+        from loader import load_dir
+
+        names, rows = [], []
+        for directory in directories:
+            for spectra in load_dir(directory).values():
+                laser = laser_nm.get(spectra.schema)
+                if spectra.unit not in ("nm", "cm-1"):
+                    continue  # no calibration for the CH341 board
+                if spectra.unit == "nm" and laser is None:
+                    continue  # lamp and filter spectra, not Raman
+                shift = raman_shift(spectra.axis, spectra.unit, laser)
+                for name, intensity in zip(spectra.names, spectra.intensities):
+                    names.append(f"{directory}/{name}")
+                    # NaN where the spectrum did not cover its set's axis
+                    rows.append(resample(np.nan_to_num(intensity), shift))
+        return cls(names, rows)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls([str(n) for n in data["names"]], data["spectra"], data["grid"])
+
+    def save(self, path):
+        np.savez(
+            path,
+            names=np.array(self.names, dtype=str),
+            spectra=self.spectra,
+            grid=self.grid,
+        )
+
+    def scores(self, query):
+        """
+        (n_references, 3) cosine, Pearson and first-derivative correlations
+        for a query already resampled onto the grid.
+        """
+        cosine, pearson, derivative = features(query)
+        return np.column_stack(
+            [
+                self.cosine @ cosine[0],
+                self.pearson @ pearson[0],
+                self.derivative @ derivative[0],
+            ]
+        )
+
+    def match(self, intensity, shift=None, k=5, method="mean"):
+        """
+        Top `k` references for a spectrum measured on the Raman shift axis
+        `shift` (or already on the grid), ranked by one method or their mean.
+        """
+        query = (
+            resample(intensity, shift, self.grid) if shift is not None else intensity
+        )
+        scores = self.scores(query)
+        ranking = (
+            scores.mean(axis=1)
+            if method == "mean"
+            else scores[:, methods.index(method)]
+        )
+        k = min(k, len(ranking))
+        top = np.argpartition(-ranking, k - 1)[:k]
+        top = top[np.argsort(-ranking[top])]
+        return [
+            Match(self.names[i], float(ranking[i]), *map(float, scores[i])) for i in top
+        ]
+
+
+def print_matches(matches):
+    for rank, match in enumerate(matches, 1):
+        print(
+            f"{rank}. {match.name}  score {match.score:.3f} "
+            f"(cos {match.cosine:.3f}, r {match.pearson:.3f}, d {match.derivative:.3f})"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spectral similarity search")
+    parser.add_argument("query", nargs="?", help="spectrum CSV to identify")
+    parser.add_argument("--library", default="library.npz")
+    parser.add_argument(
+        "--build", nargs="*", help="directories to build the library from"
+    )
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument(
+        "--bench", type=int, metavar="N", help="time queries against N references"
+    )
+    args = parser.parse_args()
+
+    if args.bench:
+        rng = np.random.default_rng(0)
+        library = SpectralLibrary(
+            range(args.bench), rng.random((args.bench, len(grid)))
+        )
+        query, shift = rng.random(3694), np.linspace(0, 3500, 3694)
+        library.match(query, shift)
+        t0 = time.perf_counter()
+        for _ in range(100):
+            library.match(query, shift)
+        per_query = (time.perf_counter() - t0) * 10
+        print(f"{args.bench} references: {per_query:.2f} ms per query")
+    elif args.build is not None:
+        library = SpectralLibrary.from_dirs(args.build or ["Data", "Concentrations"])
+        library.save(args.library)
+        print(f"Saved {len(library)} references to {args.library}")
+    else:
+        library = SpectralLibrary.load(args.library)
+
+    if args.query:
+        from loader import load_files
+
+        schema, axis, unit, intensity = load_files([args.query])[0]
+        shift = raman_shift(axis, unit, laser_nm.get(schema))
+        t0 = time.perf_counter()
+        matches = library.match(intensity, shift, args.k)
+        print(
+            f"Matched against {len(library)} references in "
+            f"{(time.perf_counter() - t0) * 1e3:.2f} ms"
+        )
+        print_matches(matches)
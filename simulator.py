@@ -0,0 +1,239 @@
+import argparse
+import glob
+import os
+import select
+import threading
+import time
+import tty
+
+import numpy as np
+
+from tcd1304 import ch341_length, length
+
+# Recorded spectra replayed by default
+er_spectra = "Archive/IYPTData/*.csv"  # 3694 pixels
+ch341_spectra = "FilterData/*.csv"  # 3648-pixel files are picked out by length
+
+
+def load_spectra(paths, n_pixels):
+    """
+    Loads single-column "intensity" CSVs and resamples them to `n_pixels`.
+    """
+    spectra = []
+    for path in paths:
+        try:
+            data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        except ValueError:
+            continue
+        if data.shape[1] != 1:
+            continue  # Wavelength,Wavenumber,Intensity webcam files
+        intensity = data[:, 0]
+        if len(intensity) != n_pixels:
+            old = np.linspace(0, 1, len(intensity))
+            intensity = np.interp(np.linspace(0, 1, n_pixels), old, intensity)
+        spectra.append(intensity - np.min(intensity))
+    if not spectra:
+        # Fall back to a laser line on a slowly varying background
+        pixels = np.arange(n_pixels)
+        spectra.append(
+            200 * np.exp(-(((pixels - n_pixels / 3) / 400) ** 2))
+            + 2000 * np.exp(-(((pixels - n_pixels / 2) / 4) ** 2))
+        )
+    return spectra
+
+
+class SensorSimulator:
+    """
+    Pretends to be a TCD1304 board on a Linux pseudo-terminal.
+
+    protocol="er" answers the 12-byte "ER" SH/ICG/AVG packet with 7388 bytes
+    (3694 little-endian 16-bit pixels). protocol="ch341" answers 0xA1 (7296
+    bytes, 12 bpp) and 0xA2 (3648 bytes, 8 bpp), each optionally followed by
+    an integration byte between 0xB0 and 0xD7. Pixels are inverted the way the
+    boards send them, so the existing readers and plots work unchanged.
+    """
+
+    def __init__(
+        self,
+        protocol="er",
+        files=None,
+        noise=5.0,
+        baudrate=None,
+        short_read=0.0,
+        pace=True,
+        seed=None,
+    ):
+        if protocol not in ("er", "ch341"):
+            raise ValueError(f"Unknown protocol: {protocol}")
+        self.protocol = protocol
+        self.n_pixels = length if protocol == "er" else ch341_length
+        if files is None:
+            files = sorted(glob.glob(er_spectra if protocol == "er" else ch341_spectra))
+        self.spectra = load_spectra(files, self.n_pixels)
+        self.noise = noise
+        self.baudrate = baudrate
+        self.short_read = short_read
+        self.pace = pace
+        self.rng = np.random.default_rng(seed)
+
+        self.frames_sent = 0
+        self.short_reads = 0
+        self.master = None
+        self._slave = None
+        self.port = None
+        self._link = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, link=None):
+        """
+        Opens the pty and starts answering requests. Returns the port name;
+        with `link` a symlink (e.g. /tmp/ttyACM0) is made to it as well.
+        """
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        if link:
+            if os.path.islink(link):
+                os.unlink(link)
+            os.symlink(self.port, link)
+            self._link = link
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        if self._link and os.path.islink(self._link):
+            os.unlink(self._link)
+        for fd in (self.master, self._slave):
+            try:
+                os.close(fd)
+            except (OSError, TypeError):
+                pass
+        self.master = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def frame(self, scale=1.0, averages=1):
+        """
+        Next replayed spectrum with Gaussian read noise, in counts.
+        """
+        spectrum = self.spectra[self.frames_sent % len(self.spectra)] * scale
+        if self.noise:
+            sigma = self.noise / np.sqrt(max(averages, 1))
+            spectrum = spectrum + self.rng.normal(0, sigma, self.n_pixels)
+        return spectrum
+
+    def er_reply(self, packet):
+        ICGperiod = int.from_bytes(packet[6:10], "big")
+        averages = max(packet[11], 1)
+        if self.pace:
+            # Periods are counted in 0.5 us ticks
+            time.sleep(ICGperiod / 2e6 * averages)
+        # analyzer_ccd subtracts the frame from dummy pixels 10/11, then flips it
+        signal = np.flip(self.frame(averages=averages))
+        raw = np.clip(3000 - signal, 0, 4095).astype("<u2")
+        raw[:16] = 3000  # dummy pixels read as the dark level
+        return raw.tobytes()
+
+    def ch341_reply(self, command, integration):
+        # Signal grows with the integration code, 0xB8 being the reference
+        scale = (integration - 0xAF) / (0xB8 - 0xAF) if integration else 1.0
+        if self.pace:
+            time.sleep(0.01 * scale)
+        signal = self.frame(scale)
+        if command == 0xA1:
+            return np.clip(4095 - signal, 0, 4095).astype("<u2").tobytes()
+        return np.clip(255 - signal / 16, 0, 255).astype(np.uint8).tobytes()
+
+    def send(self, data):
+        if self.short_read and self.rng.random() < self.short_read:
+            data = data[: int(self.rng.integers(0, len(data)))]
+            self.short_reads += 1
+        # Pace like a UART: 10 bits per byte
+        chunk = 256
+        for i in range(0, len(data), chunk):
+            os.write(self.master, data[i : i + chunk])
+            if self.baudrate:
+                time.sleep(10 * len(data[i : i + chunk]) / self.baudrate)
+        self.frames_sent += 1
+
+    def _read(self, pending):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if ready:
+                try:
+                    return pending + os.read(self.master, 4096)
+                except OSError:
+                    return pending
+        return pending
+
+    def _handle(self, pending):
+        """
+        Answers every complete request in `pending` and returns the leftover.
+        """
+        if self.protocol == "er":
+            while True:
+                start = pending.find(b"ER")
+                if start < 0:
+                    return pending[-1:]
+                if len(pending) - start < 12:
+                    return pending[start:]
+                packet, pending = pending[start : start + 12], pending[start + 12 :]
+                self.send(self.er_reply(packet))
+        while pending:
+            command, pending = pending[0], pending[1:]
+            if command not in (0xA1, 0xA2):
+                continue
+            integration = None
+            if pending and 0xB0 <= pending[0] <= 0xD7:
+                integration, pending = pending[0], pending[1:]
+            self.send(self.ch341_reply(command, integration))
+        return pending
+
+    def _serve(self):
+        pending = b""
+        while not self._stop.is_set():
+            pending = self._handle(self._read(pending))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TCD1304 board simulator on a pty")
+    parser.add_argument("files", nargs="*", help="intensity CSVs to replay")
+    parser.add_argument("--protocol", choices=("er", "ch341"), default="er")
+    parser.add_argument("--noise", type=float, default=5.0, help="read noise (counts)")
+    parser.add_argument("--baud", type=int, default=None, help="pace output (baud)")
+    parser.add_argument(
+        "--short-read", type=float, default=0.0, help="probability of a short reply"
+    )
+    parser.add_argument("--no-pace", action="store_true", help="skip integration time")
+    parser.add_argument("--link", default=None, help="symlink to the pty")
+    args = parser.parse_args()
+
+    simulator = SensorSimulator(
+        args.protocol,
+        files=args.files or None,
+        noise=args.noise,
+        baudrate=args.baud,
+        short_read=args.short_read,
+        pace=not args.no_pace,
+    )
+    port = simulator.start(link=args.link)
+    print(f"Simulating TCD1304 ({args.protocol}) on {args.link or port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(
+                f"Frames sent: {simulator.frames_sent}, short: {simulator.short_reads}"
+            )
+    except KeyboardInterrupt:
+        simulator.stop()
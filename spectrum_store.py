@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import re
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+file_magic = b"QFSPEC01"
+record_magic = b"REC0"
+# magic, n_pixels, timestamp, metadata bytes, data bytes, flags
+record_header = struct.Struct("<4sIdIIB3x")
+COMPRESSED = 1
+HAS_AXIS = 2
+
+# Directories of recorded spectra imported by default
+import_dirs = ["Data", "FilterData", "Concentrations", "Archive/IYPTData"]
+
+
+class Record(NamedTuple):
+    intensity: np.ndarray
+    axis: np.ndarray  # None unless stored explicitly (e.g. literature data)
+    metadata: dict
+    timestamp: float
+
+
+def _pack(values, compress):
+    data = np.ascontiguousarray(values, dtype="<f4").tobytes()
+    if not compress:
+        return data
+    # Byte-shuffle the floats so zlib sees the slowly varying exponent bytes
+    shuffled = np.frombuffer(data, np.uint8).reshape(-1, 4).T.tobytes()
+    return zlib.compress(shuffled, 1)
+
+
+def _unpack(data, compressed, n_values):
+    if compressed:
+        shuffled = np.frombuffer(zlib.decompress(data), np.uint8)
+        data = shuffled.reshape(4, n_values).T.tobytes()
+    return np.frombuffer(data, dtype="<f4", count=n_values).astype(np.float64)
+
+
+class SpectrumStore:
+    """
+    Append-only binary file holding many spectra with per-record metadata
+    (SH/ICG, averages, laser wavelength, calibration, dark frame, ...).
+
+    Each record is a fixed header, JSON metadata and float32 intensities
+    (byte-shuffled and zlib-compressed by default). Opening the file scans
+    only the headers, so any record can then be read by index or by time.
+    """
+
+    def __init__(self, path, compress=True):
+        self.path = Path(path)
+        self.compress = compress
+        self.offsets = []
+        self.timestamps = []
+        new = not self.path.exists() or self.path.stat().st_size == 0
+        self.file = open(self.path, "a+b")
+        if new:
+            self.file.write(file_magic)
+            self.file.flush()
+        else:
+            self._scan()
+
+    def _scan(self):
+        self.file.seek(0)
+        if self.file.read(len(file_magic)) != file_magic:
+            raise ValueError(f"{self.path} is not a spectrum store")
+        offset = len(file_magic)
+        size = os.fstat(self.file.fileno()).st_size
+        while offset + record_header.size <= size:
+            self.file.seek(offset)
+            magic, _, timestamp, meta_len, data_len, _ = record_header.unpack(
+                self.file.read(record_header.size)
+            )
+            end = offset + record_header.size + meta_len + data_len
+            if magic != record_magic or end > size:
+                break  # truncated by an interrupted write
+            self.offsets.append(offset)
+            self.timestamps.append(timestamp)
+            offset = end
+        if offset < size:
+            # Drop the partial record so appends continue from the last good one
+            self.file.truncate(offset)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def size(self):
+        """
+        Bytes in the file, including records appended since opening.
+        """
+        return self.file.seek(0, os.SEEK_END)
+
+    def __getitem__(self, index):
+        return self.read(index)
+
+    def append(self, intensity, metadata=None, timestamp=None, axis=None):
+        """
+        Appends one spectrum and returns its index.
+        """
+        intensity = np.asarray(intensity)
+        flags = COMPRESSED if self.compress else 0
+        values = intensity
+        if axis is not None:
+            flags |= HAS_AXIS
+            values = np.concatenate([np.asarray(axis, dtype=np.float64), intensity])
+        meta = json.dumps(metadata or {}, default=_json_default).encode()
+        data = _pack(values, self.compress)
+        timestamp = time.time() if timestamp is None else float(timestamp)
+        header = record_header.pack(
+            record_magic, len(intensity), timestamp, len(meta), len(data), flags
+        )
+
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        self.file.write(header + meta + data)
+        self.file.flush()
+        self.offsets.append(offset)
+        self.timestamps.append(timestamp)
+        return len(self.offsets) - 1
+
+    def _read_header(self, index):
+        self.file.seek(self.offsets[index])
+        header = record_header.unpack(self.file.read(record_header.size))
+        metadata = json.loads(self.file.read(header[3]))
+        return header, metadata
+
+    def read(self, index):
+        header, metadata = self._read_header(index)
+        _, n_pixels, timestamp, _, data_len, flags = header
+        n_values = 2 * n_pixels if flags & HAS_AXIS else n_pixels
+        values = _unpack(self.file.read(data_len), flags & COMPRESSED, n_values)
+        axis = values[:n_pixels] if flags & HAS_AXIS else None
+        return Record(values[-n_pixels:], axis, metadata, timestamp)
+
+    def at_time(self, timestamp):
+        """
+        Index of the last record taken at or before `timestamp`.
+        """
+        times = np.asarray(self.timestamps)
+        order = np.argsort(times, kind="stable")
+        position = np.searchsorted(times[order], timestamp, side="right") - 1
+        return int(order[position]) if position >= 0 else None
+
+    def between(self, start, end):
+        """
+        Indices of the records taken between `start` and `end` (unix seconds).
+        """
+        times = np.asarray(self.timestamps)
+        return np.flatnonzero((times >= start) & (times <= end))
+
+    def find(self, **metadata):
+        """
+        Indices of the records whose metadata matches every keyword given.
+        """
+        matches = []
+        for index in range(len(self)):
+            _, record_meta = self._read_header(index)
+            if all(record_meta.get(k) == v for k, v in metadata.items()):
+                matches.append(index)
+        return matches
+
+    def export_csv(self, index, path):
+        record = self.read(index)
+        with open(path, "w") as f:
+            f.write("intensity\n")
+            np.savetxt(f, record.intensity, fmt="%.6g")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_open_stores = {}
+
+
+def open_store(path):
+    """
+    Store shared by everything in this process that saves to `path`, opened
+    on first use so importing a script never creates the file.
+    """
+    path = str(Path(path).resolve())
+    if path not in _open_stores:
+        _open_stores[path] = SpectrumStore(path)
+    return _open_stores[path]
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot store {type(value).__name__} in metadata")
+
+
+def _timestamp_from_name(path):
+    match = re.search(r"(\d{8}_\d{6})", Path(path).stem)
+    if match:
+        return time.mktime(time.strptime(match.group(1), "%Y%m%d_%H%M%S"))
+    return os.path.getmtime(path)
+
+
+def read_recorded_csv(path):
+    """
+    Reads one of the repo's spectrum CSVs. Returns (intensity, axis, metadata).
+    """
+    with open(path) as f:
+        header = f.readline().strip()
+    columns = [c.strip().lower() for c in header.split(",")]
+    metadata = {"source": str(path), "name": Path(path).stem}
+
+    if columns == ["intensity"]:
+        intensity = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=1)
+        # 3694 pixels from the ER board (632.8 nm), 3648 from the CH341 board
+        metadata["sensor"] = "er" if len(intensity) == 3694 else "ch341"
+        metadata["laser_nm"] = 632.8 if len(intensity) == 3694 else None
+        return intensity, None, metadata
+
+    if columns[:1] == ["wavelength"]:
+        data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        pixels = np.arange(len(data))
+        metadata["sensor"] = "webcam"
+        metadata["laser_nm"] = 532
+        metadata["calibration"] = np.polyfit(pixels, data[:, 0], 1).tolist()
+        return data[:, columns.index("intensity")], None, metadata
+
+    # Headerless pairs (reference spectra), tab or comma separated
+    delimiter = "\t" if "\t" in header else ","
+    data = np.loadtxt(path, delimiter=delimiter, ndmin=2)
+    metadata["sensor"] = "reference"
+    return data[:, 1], data[:, 0], metadata
+
+
+def import_csvs(store, paths):
+    """
+    Appends the given CSV files to `store`; unreadable files are skipped.
+    """
+    imported = 0
+    for path in paths:
+        try:
+            intensity, axis, metadata = read_recorded_csv(path)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        store.append(intensity, metadata, _timestamp_from_name(path), axis)
+        imported += 1
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import spectrum CSVs into a store")
+    parser.add_argument("dirs", nargs="*", default=import_dirs)
+    parser.add_argument("--output", default="spectra.spec")
+    args = parser.parse_args()
+
+    paths = sorted(p for d in args.dirs for p in Path(d).glob("*.csv") if p.is_file())
+    t0 = time.perf_counter()
+    with SpectrumStore(args.output) as store:
+        imported = import_csvs(store, paths)
+    print(f"Imported {imported} spectra in {time.perf_counter() - t0:.2f} s")
+
+    csv_bytes = sum(p.stat().st_size for p in paths)
+    store_bytes = Path(args.output).stat().st_size
+    print(
+        f"CSV: {csv_bytes / 1e6:.2f} MB, store: {store_bytes / 1e6:.2f} MB "
+        f"({csv_bytes / store_bytes:.1f}x smaller)"
+    )
+
+    import pandas as pd
+
+    t0 = time.perf_counter()
+    for path in paths:
+        pd.read_csv(path)
+    csv_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    with SpectrumStore(args.output) as store:
+        for index in range(len(store)):
+            store.read(index)
+    store_time = time.perf_counter() - t0
+    print(
+        f"Load all: pandas {csv_time * 1e3:.0f} ms, store {store_time * 1e3:.0f} ms "
+        f"({csv_time / store_time:.1f}x faster)"
+    )
@@ -0,0 +1,237 @@
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+# Constants
+length = 3694  # Number of pixels (7388 bytes / 2)
+bytes_expected = length * 2  # 12-bit data in little-endian 16-bit words
+ch341_length = 3648  # Pixels sent by the CH341 board (0xA1: 7296 bytes, 0xA2: 3648)
+
+
+class ShortReadError(ValueError):
+    """
+    Raised when the serial port returned fewer bytes than a full frame.
+    """
+
+    def __init__(self, received, expected):
+        super().__init__(f"Incomplete data received: {received} of {expected} bytes")
+        self.received = received
+        self.expected = expected
+
+
+def decode_12bpp(buffer, length=length):
+    """
+    Views a raw 12-bit frame (packed in 16-bit words) as a uint16 array.
+    No copy is made, so the result shares memory with `buffer`; copy it before
+    reusing a bytearray for the next read.
+    """
+    if len(buffer) < 2 * length:
+        raise ShortReadError(len(buffer), 2 * length)
+    return np.frombuffer(buffer, dtype="<u2", count=length)
+
+
+def decode_frames(buffer, length=length):
+    """
+    Views N concatenated raw frames as an (N, length) uint16 array in one call.
+    """
+    frame_bytes = 2 * length
+    n_frames, remainder = divmod(len(buffer), frame_bytes)
+    if remainder:
+        raise ShortReadError(remainder, frame_bytes)
+    return np.frombuffer(buffer, dtype="<u2").reshape(n_frames, length)
+
+
+class ReadStatus(NamedTuple):
+    received: int
+    expected: int
+    elapsed: float
+
+    @property
+    def complete(self):
+        return self.received >= self.expected
+
+    def __str__(self):
+        return (
+            f"Received {self.received} bytes out of {self.expected} "
+            f"in {self.elapsed:.2f} s"
+        )
+
+
+def read_into(ser, buffer, timeout=5):
+    """
+    Fills a preallocated `buffer` from the port in place, blocking in the OS
+    until it is full or `timeout` seconds have passed. Nothing is polled, so
+    the CPU stays idle for the whole integration time.
+    """
+    view = memoryview(buffer).cast("B")
+    expected = len(view)
+    received = 0
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+    # Setting the timeout reconfigures the port, so it is only shortened when
+    # a read returns early, and the caller's timeout is put back afterwards
+    original = ser.timeout
+    remaining = timeout
+    try:
+        while received < expected and remaining > 0:
+            if ser.timeout != remaining:
+                ser.timeout = remaining
+            received += ser.readinto(view[received:]) or 0
+            remaining = deadline - time.monotonic()
+    finally:
+        if ser.timeout != original:
+            ser.timeout = original
+    return ReadStatus(received, expected, time.monotonic() - start_time)
+
+
+def read_ch341_frame(ser, packet, buffer, timeout=5):
+    """
+    Sends a CH341 board request (0xA1 for 12 bpp or 0xA2 for 8 bpp, optionally
+    followed by an integration time byte) and reads the reply into `buffer`.
+    """
+    ser.reset_input_buffer()
+    ser.write(packet)  # Request data
+    return read_into(ser, buffer, timeout)
+
+
+def er_packet(SHperiod, ICGperiod, averages):
+    """
+    Builds the 12-byte ER request: key, SH and ICG periods (big-endian 32-bit)
+    and the number of averages.
+    """
+    return (
+        b"ER"
+        + int(SHperiod).to_bytes(4, "big")
+        + int(ICGperiod).to_bytes(4, "big")
+        + bytes([0, int(averages)])
+    )
+
+
+def read_er_frame(ser, packet):
+    """
+    Sends an ER request and returns the decoded 12-bit frame.
+    """
+    ser.reset_input_buffer()
+    ser.write(packet)  # Send command packet
+    return decode_12bpp(ser.read(bytes_expected))
+
+
+def integration_time(ICGperiod, averages):
+    """
+    Longest time in seconds the ER board takes to integrate a request:
+    `averages` ICG periods (0.5 us ticks), plus one for a request arriving
+    mid-cycle.
+    """
+    return (int(averages) + 1) * int(ICGperiod) / 2e6
+
+
+class SensorSession:
+    """
+    Keeps one serial connection to an ER-protocol board open across
+    acquisitions. When the port drops out, or a read fails or times out,
+    the session reconnects with exponential backoff and repeats the request
+    with the same SH/ICG/averages.
+
+    The read timeout defaults to the integration time (one ICG period more
+    than ICG x averages, as a request can arrive mid-cycle) plus the
+    transfer time and `timeout_margin` seconds. An explicit `timeout`
+    shorter than the integration time is rejected.
+    """
+
+    def __init__(
+        self,
+        port,
+        baudrate,
+        SHperiod,
+        ICGperiod,
+        averages,
+        timeout=None,
+        timeout_margin=2.0,
+        min_backoff=0.5,
+        max_backoff=30,
+    ):
+        self.port = port
+        self.baudrate = baudrate
+        self.integration_time = integration_time(ICGperiod, averages)
+        if timeout is None:
+            transfer = 10 * bytes_expected / baudrate
+            timeout = self.integration_time + transfer + timeout_margin
+        elif timeout <= self.integration_time:
+            raise ValueError(
+                f"Timeout of {timeout} s is shorter than the integration time "
+                f"of {self.integration_time:.2f} s"
+            )
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.packet = er_packet(SHperiod, ICGperiod, averages)
+        self.ser = None
+        self.backoff = min_backoff
+
+        # Timing statistics
+        self.connects = 0
+        self.connect_time = 0.0
+        self.acquisitions = 0
+        self.acquire_time = 0.0
+
+    def _wait(self):
+        time.sleep(self.backoff)
+        self.backoff = min(2 * self.backoff, self.max_backoff)
+
+    def open(self):
+        import serial
+
+        while self.ser is None:
+            t0 = time.perf_counter()
+            try:
+                self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+            except serial.SerialException as e:
+                print(f"Serial port error: {e}. Retrying in {self.backoff:.1f} s")
+                self._wait()
+                continue
+            self.connects += 1
+            self.connect_time += time.perf_counter() - t0
+            print(f"Connected to {self.port}")
+        return self.ser
+
+    def close(self):
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except Exception:
+                pass
+            self.ser = None
+
+    def acquire(self):
+        import serial
+
+        while True:
+            ser = self.open()
+            t0 = time.perf_counter()
+            try:
+                frame = read_er_frame(ser, self.packet)
+            except (serial.SerialException, OSError, ShortReadError) as e:
+                print(f"Serial port error: {e}. Reconnecting in {self.backoff:.1f} s")
+                self.close()
+                self._wait()
+                continue
+            self.backoff = self.min_backoff
+            self.acquisitions += 1
+            self.acquire_time += time.perf_counter() - t0
+            return frame
+
+    def report(self):
+        connect = self.connect_time / max(self.connects, 1)
+        acquire = self.acquire_time / max(self.acquisitions, 1)
+        return (
+            f"Connection setup: {connect * 1e3:.1f} ms x {self.connects}, "
+            f"acquisition: {acquire * 1e3:.1f} ms x {self.acquisitions}"
+        )
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
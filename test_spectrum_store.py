@@ -0,0 +1,33 @@
+import os
+import zlib
+
+import numpy as np
+
+from spectrum_store import SpectrumStore
+
+
+def test_append_after_interrupted_write(tmp_path):
+    path = tmp_path / "spectra.spec"
+    first = np.arange(100, dtype=np.float64)
+    with SpectrumStore(path) as store:
+        store.append(first, {"name": "first"}, 1.0)
+        store.append(first + 1, {"name": "partial"}, 2.0)
+
+    # A run killed halfway through writing its last record
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 5)
+
+    second = np.linspace(0, 1, 100)
+    with SpectrumStore(path) as store:
+        assert len(store) == 1
+        store.append(second, {"name": "second"}, 3.0)
+
+    with SpectrumStore(path) as store:
+        assert len(store) == 2
+        assert store.find(name="second") == [1]
+        try:
+            record = store.read(1)
+        except zlib.error as e:
+            raise AssertionError(f"Appended record is corrupt: {e}")
+        assert np.allclose(record.intensity, second.astype(np.float32))
+        assert np.array_equal(store.read(0).intensity, first)
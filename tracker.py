@@ -0,0 +1,299 @@
+import argparse
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+LN2 = np.log(2)
+
+
+class TrackedPeak(NamedTuple):
+    id: int
+    position: float  # sub-pixel
+    height: float  # above the local baseline
+    width: float  # FWHM in pixels
+    age: int  # frames since first seen
+    missed: int  # consecutive frames it was not found
+
+
+def frame_noise(frame):
+    """
+    Standard deviation of the noise of a frame, from the median absolute
+    deviation of its first differences (insensitive to the lines).
+    """
+    diff = np.diff(frame)
+    mad = np.median(np.abs(diff - np.median(diff)))
+    return max(1.4826 * mad / np.sqrt(2), 1e-12)
+
+
+def smoothed_noise(noise, sigma):
+    """
+    Noise left of white noise `noise` after Gaussian smoothing with `sigma`
+    pixels. Smoothed frames have almost no pixel-to-pixel noise, so
+    frame_noise must be taken before smoothing and scaled with this.
+    """
+    return noise / np.sqrt(2 * np.sqrt(np.pi) * sigma) if sigma > 0 else noise
+
+
+class PeakTracker:
+    """
+    Follows peaks from frame to frame and keeps their identities.
+
+    Known peaks are only refined: each one is looked for within `gate`
+    pixels of its last position and its center, width and height are
+    re-estimated in closed form for all peaks at once. A full peak search
+    runs every `redetect_every` frames (or when nothing is tracked) to pick
+    up new peaks. A new peak only gets an id once it has been found in
+    `confirm` consecutive frames, and a peak missing for more than
+    `max_missed` frames is dropped.
+
+    Peaks must stand `min_snr` times the frame noise (the MAD of its
+    first differences, re-estimated on every search) above the baseline,
+    the minimum within `baseline_window` pixels. Refined widths are kept
+    only up to `max_width` pixels (default: the refinement window).
+
+    Position, height and width of every tracked peak are kept for the last
+    `history` frames in one preallocated array; see `series`.
+    """
+
+    def __init__(
+        self,
+        max_peaks=32,
+        history=1000,
+        min_snr=8.0,
+        gate=6,
+        redetect_every=25,
+        max_missed=5,
+        confirm=3,
+        baseline_window=25,
+        max_width=None,
+    ):
+        self.max_peaks = max_peaks
+        self.min_snr = min_snr
+        self.gate = gate
+        self.redetect_every = redetect_every
+        self.max_missed = max_missed
+        self.confirm = confirm
+        self.max_width = 2 * gate + 1 if max_width is None else max_width
+        self._offsets = np.arange(-gate, gate + 1)
+        self._baseline_offsets = np.arange(-baseline_window, baseline_window + 1)
+        self.noise = None
+
+        # Current state, one slot per peak (active: tracked, id -1 until
+        # confirmed)
+        self.active = np.zeros(max_peaks, dtype=bool)
+        self.ids = np.full(max_peaks, -1)
+        self.position = np.zeros(max_peaks)
+        self.height = np.zeros(max_peaks)
+        self.width = np.zeros(max_peaks)
+        self.first_frame = np.zeros(max_peaks, dtype=int)
+        self.hits = np.zeros(max_peaks, dtype=int)
+        self.missed = np.zeros(max_peaks, dtype=int)
+        self.next_id = 0
+        self.frames = 0
+
+        # Ring buffer of (position, height, width) per slot and its owner id
+        self.times = np.full(history, np.nan)
+        self.values = np.full((history, max_peaks, 3), np.nan, dtype=np.float32)
+        self.owners = np.full((history, max_peaks), -1)
+
+    def update(self, frame, timestamp=None, noise=None):
+        """
+        Processes one spectrum (peaks pointing up). `noise` overrides the
+        noise estimate, e.g. for smoothed frames. Returns the number of
+        confirmed peaks.
+        """
+        frame = np.asarray(frame, dtype=np.float64)
+        search = not self.active.any() or self.frames % self.redetect_every == 0
+        if noise is not None:
+            self.noise = noise
+        elif search or self.noise is None:
+            self.noise = frame_noise(frame)
+        min_height = self.min_snr * self.noise
+
+        if search:
+            self._detect(frame, min_height)
+        if self.active.any():
+            self._refine(frame, np.flatnonzero(self.active), min_height)
+
+        row = self.frames % len(self.times)
+        confirmed = self.ids >= 0
+        self.times[row] = time.time() if timestamp is None else timestamp
+        self.values[row] = np.nan
+        self.values[row, confirmed] = np.column_stack(
+            [self.position[confirmed], self.height[confirmed], self.width[confirmed]]
+        )
+        self.owners[row] = self.ids
+        self.frames += 1
+        return int(np.count_nonzero(confirmed))
+
+    def _refine(self, frame, slots, min_height):
+        n = len(frame)
+        center = np.rint(self.position[slots]).astype(int)
+        window = np.clip(center[:, None] + self._offsets, 0, n - 1)
+        values = frame[window]
+        rows = np.arange(len(slots))
+        peak = window[rows, values.argmax(axis=1)]
+        around = np.clip(peak[:, None] + self._baseline_offsets, 0, n - 1)
+        baseline = frame[around].min(axis=1)
+
+        # Caruana: parabola through the log of the three top pixels
+        left = np.maximum(frame[np.maximum(peak - 1, 0)] - baseline, 1e-12)
+        top = np.maximum(frame[peak] - baseline, 1e-12)
+        right = np.maximum(frame[np.minimum(peak + 1, n - 1)] - baseline, 1e-12)
+        l0, l1, l2 = np.log(left), np.log(top), np.log(right)
+        curvature = l0 - 2 * l1 + l2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            offset = 0.5 * (l0 - l2) / curvature
+            width = np.sqrt(-8 * LN2 / curvature)
+
+        found = (top > min_height) & (curvature < 0) & (np.abs(offset) <= 1)
+        found &= (peak > window[:, 0]) & (peak < window[:, -1])  # not on the gate
+        found &= width <= self.max_width
+        hit = slots[found]
+        self.position[hit] = peak[found] + offset[found]
+        self.height[hit] = top[found]
+        self.width[hit] = width[found]
+        self.missed[hit] = 0
+        self.hits[hit] += 1
+        self.missed[slots[~found]] += 1
+
+        # Tentative peaks must be found in every frame until confirmed
+        tentative = self.ids[slots] < 0
+        lost = self.missed[slots] > np.where(tentative, 0, self.max_missed)
+        self._free(slots[lost])
+        ready = slots[tentative & ~lost & (self.hits[slots] >= self.confirm)]
+        self.ids[ready] = np.arange(self.next_id, self.next_id + len(ready))
+        self.next_id += len(ready)
+
+        # Two tracks that converged onto the same peak: keep the oldest one
+        active = np.flatnonzero(self.active)
+        order = active[np.lexsort((self.first_frame[active], self.ids[active] < 0))]
+        _, first = np.unique(np.rint(self.position[order]), return_index=True)
+        duplicate = np.ones(len(order), dtype=bool)
+        duplicate[first] = False
+        self._free(order[duplicate])
+
+    def _free(self, slots):
+        self.active[slots] = False
+        self.ids[slots] = -1
+
+    def _detect(self, frame, min_height):
+        from scipy.signal import find_peaks
+
+        # Widths at half prominence, only up to what refining can follow
+        peaks, properties = find_peaks(
+            frame, prominence=min_height, distance=self.gate, width=(0, self.max_width)
+        )
+        prominences, widths = properties["prominences"], properties["widths"]
+        if self.active.any() and len(peaks):
+            distance = np.abs(peaks[:, None] - self.position[self.active][None, :])
+            new = distance.min(axis=1) > self.gate
+            peaks, prominences, widths = peaks[new], prominences[new], widths[new]
+
+        free = np.flatnonzero(~self.active)
+        strongest = np.argsort(prominences)[::-1][: len(free)]
+        slots = free[: len(strongest)]
+        self.active[slots] = True
+        # Detection estimates, until the first refine replaces them
+        self.position[slots] = peaks[strongest]
+        self.height[slots] = prominences[strongest]
+        self.width[slots] = widths[strongest]
+        self.first_frame[slots] = self.frames
+        self.hits[slots] = 0
+        self.missed[slots] = 0
+
+    def peaks(self):
+        """
+        Currently tracked peaks, sorted by position.
+        """
+        slots = np.flatnonzero(self.ids >= 0)
+        slots = slots[np.argsort(self.position[slots])]
+        return [
+            TrackedPeak(
+                int(self.ids[s]),
+                float(self.position[s]),
+                float(self.height[s]),
+                float(self.width[s]),
+                self.frames - int(self.first_frame[s]),
+                int(self.missed[s]),
+            )
+            for s in slots
+        ]
+
+    def series(self, peak_id):
+        """
+        (times, positions, heights, widths) of one peak over the retained
+        history, oldest first.
+        """
+        order = np.roll(np.arange(len(self.times)), -(self.frames % len(self.times)))
+        rows, slots = np.nonzero(self.owners[order] == peak_id)
+        values = self.values[order[rows], slots]
+        return (self.times[order[rows]], *values.T)
+
+    def table(self, axis=None):
+        """
+        The tracked peaks as text; positions are also converted with `axis`
+        (e.g. Raman shift per pixel) when given.
+        """
+        unit = "" if axis is None else f"{'position':>17}"
+        lines = [f"{'id':>4} {'pixel':>8}{unit} {'height':>8} {'fwhm':>6} {'age':>5}"]
+        for peak in self.peaks():
+            converted = ""
+            if axis is not None:
+                value = np.interp(peak.position, np.arange(len(axis)), axis)
+                converted = f" {value:16.1f}"
+            lines.append(
+                f"{peak.id:>4} {peak.position:8.2f}{converted} {peak.height:8.1f} "
+                f"{peak.width:6.2f} {peak.age:5d}"
+            )
+        return "\n".join(lines)
+
+
+def bleaching_frames(n_frames, length=3694, n_peaks=20, seed=0):
+    """
+    Synthetic frames whose lines drift, broaden and bleach, for benchmarking.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.arange(length)
+    centers = np.linspace(100, length - 100, n_peaks) + rng.uniform(-20, 20, n_peaks)
+    heights = rng.uniform(300, 2000, n_peaks)
+    widths = rng.uniform(3, 7, n_peaks)
+    for i in range(n_frames):
+        decay = np.exp(-i / n_frames)
+        lines = (
+            heights[:, None]
+            * decay
+            * np.exp(
+                -4
+                * LN2
+                * (x - centers[:, None] - 0.01 * i) ** 2
+                / (widths[:, None] * (1 + i / (4 * n_frames))) ** 2
+            )
+        )
+        yield 100 + lines.sum(axis=0) + rng.normal(0, 10, length)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak tracker benchmark")
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--peaks", type=int, default=20)
+    args = parser.parse_args()
+
+    frames = list(bleaching_frames(args.frames, n_peaks=args.peaks))
+    tracker = PeakTracker()
+    tracker.update(frames[0])
+    t0 = time.perf_counter()
+    for frame in frames[1:]:
+        tracker.update(frame)
+    per_frame = (time.perf_counter() - t0) / (len(frames) - 1)
+    print(tracker.table())
+    print(
+        f"{per_frame * 1e6:.0f} us per frame ({1 / per_frame:.0f} fps), "
+        f"{tracker.next_id} ids for {args.peaks} peaks"
+    )
+    _, positions, heights, widths = tracker.series(tracker.peaks()[0].id)
+    print(
+        f"Peak {tracker.peaks()[0].id}: {len(positions)} samples, height "
+        f"{heights[0]:.0f} -> {heights[-1]:.0f}, fwhm {widths[0]:.2f} -> {widths[-1]:.2f}"
+    )
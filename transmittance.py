@@ -1,13 +1,16 @@
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import tkinter as tk
-from tkinter import filedialog
 from pathlib import Path
 
-from analyzer_ccd import wavelengths
+from calibration import load_calibration
+
+wavelengths = load_calibration("er").wavelengths
 
 def calculate_absorbance():
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import tkinter as tk
+    from tkinter import filedialog
+
     root = tk.Tk()
     root.withdraw()
 
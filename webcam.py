@@ -0,0 +1,200 @@
+import argparse
+import time
+
+import numpy as np
+
+from acquisition import AcquisitionThread, FrameRing
+
+length = 1920  # frame width, one spectrum pixel per column
+height = 1080
+roi = (0.53, 0.64)  # rows holding the spectrum, as fractions of the height
+
+
+def roi_rows(height=height, roi=roi):
+    return int(roi[0] * height), int(roi[1] * height)
+
+
+def frame_view(frame, width=length):
+    """
+    A camera frame as (rows, width, channels): 3 for BGR, 2 for raw YUYV
+    (luma in channel 0) or 1 for grayscale. With RGB conversion off, V4L2
+    hands YUYV frames over as one flat row of bytes.
+    """
+    if frame.ndim == 2 and frame.shape[0] == 1:
+        return frame.reshape(-1, width, 2)
+    if frame.ndim == 2:
+        return frame[:, :, None]
+    return frame
+
+
+class RoiReducer:
+    """
+    Spectrum of a frame: the mean over the ROI rows of luma (YUYV or
+    grayscale) or of the three channels (BGR). Only the ROI is read, and
+    it is summed into a preallocated accumulator. Mirroring reverses the
+    spectrum rather than the image.
+
+    The returned spectrum is reused by the next call.
+    """
+
+    def __init__(self, rows, width=length, mirror=True):
+        self.rows = slice(*rows)
+        self.width = width
+        self.mirror = mirror
+        self.sum = np.zeros(width, np.uint32)
+        self._channels = np.zeros(3 * width, np.uint32)
+        self.spectrum = np.zeros(width, np.float32)
+
+    def __call__(self, frame):
+        region = frame_view(frame, self.width)[self.rows]
+        if region.shape[2] == 3:
+            # Rows first, over contiguous memory, then the three channels
+            rows = region.reshape(region.shape[0], -1)
+            np.sum(rows, axis=0, dtype=np.uint32, out=self._channels)
+            np.sum(self._channels.reshape(-1, 3), axis=1, out=self.sum)
+            count = 3 * region.shape[0]
+        else:
+            np.sum(region[:, :, 0], axis=0, dtype=np.uint32, out=self.sum)
+            count = region.shape[0]
+        source = self.sum[::-1] if self.mirror else self.sum
+        np.multiply(source, 1 / count, out=self.spectrum)
+        return self.spectrum
+
+
+def open_camera(index=0, width=length, height=height, fourcc="YUYV", fps=None):
+    """
+    Opens a V4L2 camera. With "YUYV" the frames are not converted to BGR,
+    so each one is a third smaller and skips the color conversion; the
+    spectrum is then taken from luma. Pass fourcc=None for the driver's
+    default (BGR) frames.
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(index, cv2.CAP_V4L2)
+    if fourcc:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if fps:
+        cap.set(cv2.CAP_PROP_FPS, fps)
+    if fourcc == "YUYV":
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    if not cap.isOpened():
+        raise IOError(f"Could not open camera {index}")
+    return cap
+
+
+class WebcamCapture:
+    """
+    Reads the camera on a background thread at its own frame rate and
+    pushes ROI spectra into a FrameRing. The last raw frame is kept for
+    `preview`, which the UI can show at a lower rate.
+    """
+
+    def __init__(self, cap, rows, width=length, mirror=True, capacity=32):
+        self.cap = cap
+        self.rows = rows
+        self.width = width
+        self.mirror = mirror
+        self.reducer = RoiReducer(rows, width, mirror)
+        self.ring = FrameRing(capacity, width, np.float32)
+        self.frame = None
+        self.thread = AcquisitionThread(self._read, self.ring)
+
+    def _read(self):
+        ok, frame = self.cap.read()
+        if not ok:
+            raise IOError("Camera read failed")
+        self.frame = frame
+        return self.reducer(frame)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=2):
+        self.thread.stop(timeout)
+
+    @property
+    def fps(self):
+        return self.thread.fps
+
+    def preview(self, scale=4):
+        """
+        Downscaled copy of the last frame, mirrored, with the ROI drawn on
+        it; None before the first frame.
+        """
+        frame = self.frame
+        if frame is None:
+            return None
+        import cv2
+
+        image = frame_view(frame, self.width)[::scale, ::scale]
+        image = image[:, ::-1] if self.mirror else image
+        if image.shape[2] == 3:
+            image, color = np.ascontiguousarray(image), (0, 255, 0)
+        else:
+            image, color = np.ascontiguousarray(image[:, :, 0]), 255
+        for row in self.rows:
+            cv2.line(image, (0, row // scale), (image.shape[1], row // scale), color, 1)
+        return image
+
+
+def full_frame_spectrum(frame, rows, mirror=True):
+    """
+    The previous analyzer.py extraction (without the cv2 overlay): mirror
+    and copy the whole BGR frame, then average the ROI over all channels.
+    """
+    if mirror:
+        frame = np.flip(frame, 1)
+    frame = np.array(frame)
+    return np.mean(frame[rows[0] : rows[1]], axis=(0, 2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Webcam ROI capture")
+    parser.add_argument("--camera", type=int, default=None, help="capture from it")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--fourcc", default="YUYV", help="'' for BGR frames")
+    parser.add_argument("--frames", type=int, default=100, help="benchmark frames")
+    args = parser.parse_args()
+
+    rows = roi_rows()
+    if args.camera is not None:
+        cap = open_camera(args.camera, fourcc=args.fourcc or None)
+        capture = WebcamCapture(cap, rows).start()
+        t0 = time.process_time()
+        time.sleep(args.seconds)
+        cpu = (time.process_time() - t0) / args.seconds
+        capture.stop()
+        cap.release()
+        print(
+            f"{capture.fps:.1f} fps, {capture.ring.written} frames, "
+            f"{cpu:.0%} of a CPU, {capture.thread.errors} read errors"
+        )
+    else:
+        rng = np.random.default_rng(0)
+        bgr = rng.integers(0, 256, (height, length, 3), dtype=np.uint8)
+        yuyv = rng.integers(0, 256, (1, height * length * 2), dtype=np.uint8)
+        reducer = RoiReducer(rows)
+        assert np.allclose(reducer(bgr), full_frame_spectrum(bgr, rows), atol=1e-3)
+
+        def per_frame(func, frame):
+            t0 = time.perf_counter()
+            for _ in range(args.frames):
+                func(frame)
+            return (time.perf_counter() - t0) / args.frames
+
+        before = per_frame(lambda frame: full_frame_spectrum(frame, rows), bgr)
+        after_bgr = per_frame(reducer, bgr)
+        after_yuyv = per_frame(reducer, yuyv)
+        print(f"Per 1080p frame, ROI rows {rows[0]}-{rows[1]}:")
+        print(f"  full frame flip/copy/mean: {before * 1e3:7.2f} ms")
+        print(
+            f"  ROI sum, BGR:              {after_bgr * 1e3:7.2f} ms "
+            f"({before / after_bgr:.0f}x)"
+        )
+        print(
+            f"  ROI sum, YUYV luma:        {after_yuyv * 1e3:7.2f} ms "
+            f"({before / after_yuyv:.0f}x)"
+        )